@@ -0,0 +1,43 @@
+"""
+Public API for embedding: processes images held in memory, without the input/output directories of FileManager.
+Operations are given the same way as in the image section of the config, and are validated the same way
+"""
+from typing import Iterable, Iterator
+
+from base_classes import BytesResult
+from config_validation import validate_structure_and_base_config, validate_ops_config
+from tools import split_config, prepare_ops_config
+from image_handler import ImageHandler
+
+
+def prepare_image_operations(operations: dict, output_ext: str = 'native') -> dict:
+    """Validates and normalizes operations like the image section of a config. Raises ConfigError if invalid"""
+    config = {'main': {}, 'image': {**operations, 'input_exts': 'all', 'output_ext': output_ext}}
+
+    validate_structure_and_base_config(config)
+    _, ops_config = split_config(config)
+    validate_ops_config(ops_config)
+    if ops_config:
+        prepare_ops_config(ops_config)
+
+    return (ops_config or {}).get('image', {})
+
+
+def process_image_bytes(data, operations: dict, output_ext: str = 'native') -> bytes:
+    """
+    Processes one encoded image given as bytes or a binary buffer and returns the encoded result.
+    output_ext is one of the supported image extensions, 'native' keeps the input format
+    """
+    operations = prepare_image_operations(operations, output_ext)
+    return ImageHandler().run_bytes(data, operations, output_ext)
+
+
+def process_image_bytes_batch(items: Iterable, operations: dict, output_ext: str = 'native') -> Iterator[BytesResult]:
+    """
+    Processes many encoded images with the same operations, yields a BytesResult per item in input order:
+    the encoded output, or the error of an item that failed, the items after it are still processed.
+    Validation, the handler and the transform plan are set up once for the whole batch.
+    Invalid operations raise ConfigError before any item is processed
+    """
+    operations = prepare_image_operations(operations, output_ext)
+    return ImageHandler().run_bytes_batch(items, operations, output_ext)
@@ -0,0 +1,143 @@
+import tarfile
+import time
+import zipfile
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import Iterator, Optional
+
+
+_TAR_SUFFIXES = {'.tar': '', '.tar.gz': 'gz', '.tgz': 'gz', '.tar.bz2': 'bz2', '.tbz2': 'bz2',
+                 '.tar.xz': 'xz', '.txz': 'xz'}
+_ZIP_COMPRESSION = {'stored': zipfile.ZIP_STORED, 'deflated': zipfile.ZIP_DEFLATED,
+                    'bzip2': zipfile.ZIP_BZIP2, 'lzma': zipfile.ZIP_LZMA}
+
+
+def _get_tar_compression(path: Path) -> Optional[str]:
+    name = path.name.lower()
+    for suffix, compression in _TAR_SUFFIXES.items():
+        if name.endswith(suffix):
+            return compression
+    return None
+
+def is_archive(path: Path) -> bool:
+    """Tells archives from directories by the name, so it works for outputs that don't exist yet"""
+    return path.name.lower().endswith('.zip') or _get_tar_compression(path) is not None
+
+
+class Member:
+    """A file read from an input source: path relative to the source root, content and modification time"""
+    __slots__ = ('path', 'data', 'mtime')
+
+    def __init__(self, path: PurePosixPath, data: bytes, mtime: float) -> None:
+        self.path = path
+        self.data = data
+        self.mtime = mtime
+
+
+def iter_members(source: Path, recursive: bool = True) -> Iterator[Member]:
+    """
+    Yields the files of a tar/zip archive one at a time.
+    Tars are read as a stream, so compressed tars are decompressed once, front to back, without seeking
+    """
+    if source.name.lower().endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                path = PurePosixPath(info.filename)
+                if info.is_dir() or (not recursive and len(path.parts) > 1):
+                    continue
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                yield Member(path, archive.read(info), mtime)
+        return
+
+    with tarfile.open(source, 'r|*') as archive:
+        for info in archive:
+            path = PurePosixPath(info.name)  # Also drops the leading ./ of tars made with -C dir .
+            if not info.isfile() or (not recursive and len(path.parts) > 1):
+                continue
+            with archive.extractfile(info) as member:
+                yield Member(path, member.read(), info.mtime)
+
+
+class ArchiveWriter:
+    """
+    Writes members into a tar (compression from the suffix: .tar, .tar.gz, .tar.bz2, .tar.xz)
+    or a zip (compression from zip_compression). The archive is built under a temp name
+    and renamed on close, so an interrupted run never leaves a truncated archive behind
+    """
+
+    def __init__(self, target: Path, zip_compression: str = 'deflated', compresslevel: Optional[int] = None) -> None:
+        self.target = target
+        self._tmp_path = target.with_name(f'{target.name}.partial')
+        self._members: set[str] = set()
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        if target.name.lower().endswith('.zip'):
+            self._zip = zipfile.ZipFile(self._tmp_path, 'w', compression=_ZIP_COMPRESSION[zip_compression],
+                                        compresslevel=compresslevel)
+            self._tar = None
+        else:
+            compression = _get_tar_compression(target)
+            kwargs = {'compresslevel': compresslevel} if compression in ('gz', 'bz2') and compresslevel else {}
+            self._tar = tarfile.open(self._tmp_path, f'w:{compression}', **kwargs)
+            self._zip = None
+
+    def add(self, path: PurePosixPath, data: bytes, mtime: Optional[float] = None) -> None:
+        name = path.as_posix()
+        if name in self._members:
+            raise ValueError(f'{name} is written to {self.target} twice')
+        self._members.add(name)
+        mtime = time.time() if mtime is None else mtime
+
+        if self._zip is not None:
+            info = zipfile.ZipInfo(name, date_time=time.localtime(max(mtime, 315532800))[:6])
+            info.compress_type = self._zip.compression
+            self._zip.writestr(info, data, compresslevel=self._zip.compresslevel)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(mtime)
+            self._tar.addfile(info, BytesIO(data))
+
+    def __contains__(self, path: PurePosixPath) -> bool:
+        return path.as_posix() in self._members
+
+    def close(self, commit: bool = True) -> None:
+        (self._zip or self._tar).close()
+        if commit:
+            self._tmp_path.replace(self.target)
+        else:
+            self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+        return False
+
+
+class DirWriter:
+    """ArchiveWriter counterpart for a directory output, used when only the input is an archive"""
+
+    def __init__(self, target: Path) -> None:
+        self.target = target
+        self._dirs: set[Path] = set()
+
+    def add(self, path: PurePosixPath, data: bytes, mtime: Optional[float] = None) -> None:
+        if path.is_absolute() or '..' in path.parts:
+            raise ValueError(f'Member path {path} points outside of {self.target}')
+
+        file = self.target / path
+        if file.parent not in self._dirs:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(file.parent)
+        file.write_bytes(data)
+
+    def close(self, commit: bool = True) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
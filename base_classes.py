@@ -1,6 +1,26 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Optional, Any
+from typing import Optional, Any, Iterable, Iterator, NamedTuple
+
+
+class JobResult(NamedTuple):
+    """
+    Outcome of one job of a batch. error is set when the job raised, success is False when it was refused.
+    outputs are the files written, which aren't always just target_path.
+    stage_seconds maps stage names to the time the job spent in them, for handlers that measure it
+    """
+    input_path: Path
+    target_path: Path
+    success: bool
+    error: Optional[Exception] = None
+    outputs: tuple[Path, ...] = ()
+    stage_seconds: Optional[dict[str, float]] = None
+
+
+class BytesResult(NamedTuple):
+    """Outcome of one in-memory item of a batch: the encoded output, or the error the item raised"""
+    data: Optional[bytes]
+    error: Optional[Exception] = None
 
 
 class MediaHandler(ABC):
@@ -8,6 +28,18 @@ class MediaHandler(ABC):
     def run(self, input_path: Path, target_path: Path, params: dict) -> bool:
         pass
 
+    def run_batch(self, jobs: Iterable[tuple[Path, Path]], params: dict) -> Iterator[JobResult]:
+        """
+        Processes (input_path, target_path) jobs with the same params, yields a result per job in order.
+        A failed job doesn't stop the batch. Runs the jobs one by one, handlers override it to share setup
+        """
+        for input_path, target_path in jobs:
+            try:
+                success = bool(self.run(input_path, target_path, params.copy()))
+                yield JobResult(input_path, target_path, success, None, (target_path,) if success else ())
+            except Exception as e:
+                yield JobResult(input_path, target_path, False, e)
+
     @abstractmethod
     def load(self):
         pass
@@ -29,6 +61,14 @@ class Loader(ABC):
     def load(self, input_path: Path) -> Any:  # Ensure path is validated
         pass
 
+    def run_batch(self, input_paths: Iterable[Path]) -> Iterator[tuple[Any, Optional[Exception]]]:
+        """Yields (item, None) or (None, error) per path, in order"""
+        for input_path in input_paths:
+            try:
+                yield self.load(input_path), None
+            except Exception as e:
+                yield None, e
+
     @property
     def input_path(self):
         return self._input_path
@@ -51,6 +91,14 @@ class Transformer(ABC):
     def transform(self, item, instructions) -> Any:
         pass
 
+    def run_batch(self, items: Iterable, instructions: dict) -> Iterator[tuple[Any, Optional[Exception]]]:
+        """Yields (item, None) or (None, error) per item, in order"""
+        for item in items:
+            try:
+                yield self.transform(item, instructions), None
+            except Exception as e:
+                yield None, e
+
     @property
     def instructions(self):
         return self._instructions.copy()
@@ -71,6 +119,15 @@ class Saver(ABC):
     def save(self, item, target_path) -> None:
         pass
 
+    def run_batch(self, items: Iterable[tuple[Any, Path]], *args) -> Iterator[Optional[Exception]]:
+        """Saves (item, target_path) pairs, yields None or the error per pair, in order"""
+        for item, target_path in items:
+            try:
+                self.save(item, target_path, *args)
+                yield None
+            except Exception as e:
+                yield e
+
     @property
     def target_path(self):
         return self._target_path
@@ -1,5 +1,7 @@
 from pathlib import Path
 
+from archive_tools import is_archive
+
 
 def validate_file(field, value, error):
     file_path = Path(value)
@@ -18,3 +20,20 @@ def validate_new_dir(field, value, error):
         logs_dir.mkdir(parents=True, exist_ok=True)
     except Exception as e:
         error(field, f'Can\'t use {new_dir_path} path to create a directory: {e}')
+
+
+def validate_input_source(field, value, error):
+    source_path = Path(value)
+    if is_archive(source_path):
+        if not source_path.is_file():
+            error(field, f'{source_path} is not a valid archive path')
+    else:
+        validate_dir(field, value, error)
+
+def validate_output_target(field, value, error):
+    target_path = Path(value)
+    if is_archive(target_path):
+        # The archive itself is created by the run, only its directory is needed
+        validate_new_dir(field, str(target_path.parent), error)
+    else:
+        validate_new_dir(field, value, error)
@@ -25,4 +25,15 @@ def validate_structure_and_base_config(config):
         raise ConfigError(f'Invalid config: {v.errors}')
 
 def validate_ops_config(ops_config):
-    pass
+    """
+    Validates the operations of every media type that has a schema. Sections of other media types are
+    left to their handlers
+    """
+    if not ops_config:
+        return
+    v = Validator(CONST.ops_config_schema, allow_unknown=True)
+    if v.validate(ops_config):
+        logging.debug('Operations are valid')
+    else:
+        logging.error(f'Invalid operations: {v.errors}')
+        raise ConfigError(f'Invalid operations: {v.errors}')
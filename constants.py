@@ -1,6 +1,8 @@
 import copy
 
-from cerberus_validations import validate_file, validate_dir, validate_new_dir
+from PIL import features
+
+from cerberus_validations import validate_file, validate_input_source, validate_output_target
 
 
 class _Constants:
@@ -23,7 +25,8 @@ class _Constants:
     def init_dicts(self):
         """Initializes dictionaries with data. Separated for better readability."""
         self._supported_types = {
-            'image': ['blp', 'bmp', 'dib', 'icns', 'ico', 'msp', 'sgi', 'jpg', 'jpeg', 'png', ],
+            'image': ['blp', 'bmp', 'dib', 'icns', 'ico', 'msp', 'sgi', 'jpg', 'jpeg', 'png', ]
+                     + self._get_optional_image_types(),
             'audio': ['mp3', 'flac', 'ogg']
             # Video types are in development
         }
@@ -36,7 +39,12 @@ class _Constants:
                 'recursive': True,
                 'overwrite_files': True,
                 'copy_other_files': True,
-                'inore_errors': True
+                'inore_errors': True,
+                'archive_compression': 'deflated',
+                'archive_compresslevel': None,  # The library default of the compression
+                'stage_split': None,  # Off
+                'batch_size': 16,
+                'sync': False
             },
             'image': {
                 'input_exts': 'all',
@@ -46,7 +54,13 @@ class _Constants:
 
         self._cli_params_schema = {
             'log_level': {'type': 'string', 'required': True, 'allowed': ['debug', 'info', 'warning', 'error']},
-            'config_file': {'type': 'string', 'required': True, 'check_with': validate_file},
+            'config_file': {'type': 'string', 'required': False, 'check_with': validate_file},
+            'shard_index': {'type': 'integer', 'required': False, 'min': 0},
+            'shard_count': {'type': 'integer', 'required': False, 'min': 1},
+            'summary_file': {'type': 'string', 'required': False, 'nullable': True},
+            'estimate_samples': {'type': 'integer', 'required': False, 'min': 1},
+            'sample': {'type': 'string', 'required': False, 'nullable': True, 'regex': r'^[1-9][0-9]*$|^[0-9]+(\.[0-9]+)?%$'},
+            'sample_seed': {'type': 'integer', 'required': False},
         }
 
         self._base_config_schema = {
@@ -54,13 +68,30 @@ class _Constants:
                 'type': 'dict',
                 'allow_unknown': False,
                 'schema': {
-                    'input_dir_path': {'type': 'string', 'check_with': validate_dir},
-                    'output_dir_path': {'type': 'string', 'check_with': validate_new_dir},
+                    # Either may be a tar/zip archive, recognized by the suffix
+                    'input_dir_path': {'type': 'string', 'check_with': validate_input_source},
+                    'output_dir_path': {'type': 'string', 'check_with': validate_output_target},
                     'clean_output_dir': {'type': 'boolean'},
                     'recursive': {'type': 'boolean'},
                     'overwrite_files': {'type': 'boolean'},
                     'copy_other_files': {'type': 'boolean'},
-                    'ignore_errors': {'type': 'boolean'}
+                    'ignore_errors': {'type': 'boolean'},
+                    # Zip outputs only, tar compression comes from the suffix (.tar, .tar.gz, .tar.bz2, .tar.xz)
+                    'archive_compression': {'type': 'string', 'allowed': ['stored', 'deflated', 'bzip2', 'lzma']},
+                    'archive_compresslevel': {'type': 'integer', 'min': 0, 'max': 9},
+                    'sync': {'type': 'boolean'},  # Mirror the input tree instead of cleaning the output dir
+                    'batch_size': {'type': 'integer', 'min': 1},  # Files handed to a media handler at once
+                    'stage_split': {
+                        'type': 'dict',
+                        'allow_unknown': False,
+                        'schema': {
+                            'decode_workers': {'type': 'integer', 'min': 1},
+                            'transform_workers': {'type': 'integer', 'min': 1},
+                            'encode_workers': {'type': 'integer', 'min': 1},
+                            'slab_mb': {'type': 'integer', 'min': 1},
+                            'slabs': {'type': 'integer', 'min': 1}
+                        }
+                    }
                 }
             },
             'image': {
@@ -83,17 +114,63 @@ class _Constants:
                 'schema': {
                     'rotate': {'type': 'integer', 'min': 0, 'max': 360},
                     'resize': {
+                        'type': 'dict',
                         'schema': {
                             'width': {'type': 'integer', 'min': 1, 'max': 9999, 'required': True},
                             'height': {'type': 'integer', 'min': 1, 'max': 9999, 'required': True},
                             'method': {'type': 'string', 'required': False,
-                                       'allowed': ['default']},
+                                       'allowed': ['default', 'stretch', 'fit', 'fill', 'fit_expand']},
                             'resampling': {'type': 'string', 'required': False,
-                                           'allowed': ['nearest', 'bilinear', 'bicubic', 'lanczos', 'box', 'hamming']}
+                                           'allowed': ['nearest', 'bilinear', 'bicubic', 'lanczos', 'box', 'hamming']},
+                            # Older name of resampling
+                            'resample': {'type': 'string', 'required': False,
+                                         'allowed': ['nearest', 'bilinear', 'bicubic', 'lanczos', 'box', 'hamming']},
+                            # Position of the image for fill and fit_expand, (0.5, 0.5) centers it
+                            'offset': {'type': 'list', 'required': False, 'minlength': 2, 'maxlength': 2,
+                                       'schema': {'type': 'number', 'min': 0, 'max': 1}},
+                            # Padding color of fit_expand, a color name or RGB values
+                            'color': {'required': False, 'anyof': [
+                                {'type': 'string'},
+                                {'type': 'list', 'minlength': 3, 'maxlength': 3,
+                                 'schema': {'type': 'integer', 'min': 0, 'max': 255}}
+                            ]},
+                            'resize_backend': {'type': 'string', 'required': False,
+                                               'allowed': ['pillow', 'numpy', 'opencv', 'auto']}
+                        }
+                    },
+                    'color_mode': {'type': 'string', 'required': False,
+                                   'allowed': ['greyscale', 'black_and_white', 'cmyk', 'rgb', 'web_palette', 'adaptive_palette']},
+                    'color_balance': {'type': 'float'},
+                    'contrast': {'type': 'float'},
+                    'brightness': {'type': 'float'},
+                    'sharpness': {'type': 'float'},
+                    # adaptive_palette only: one palette for the whole run, quantized from sample_size images
+                    'shared_palette': {
+                        'type': 'dict',
+                        'allow_unknown': False,
+                        'schema': {
+                            'sample_size': {'type': 'integer', 'min': 1},
+                            'colors': {'type': 'integer', 'min': 2, 'max': 256},
+                            'cache_dir': {'type': 'string'}
                         }
                     },
-                    'color_mode': {'type': 'string', 'required': True,
-                                   'allowed': ['greyscale', 'black_and_white', 'cmyk', 'rgb', 'web_palette', 'adaptive_palette']}
+                    # best: the smallest frame that covers the resize target, all: every frame as its own output,
+                    # list of widths: those frames as their own outputs. Only read for ico/icns inputs
+                    'icon_frames': {'anyof': [
+                        {'type': 'string', 'allowed': ['best', 'all']},
+                        {'type': 'list', 'schema': {'type': 'integer', 'min': 1}}
+                    ]},
+                    'encoder': {
+                        'type': 'dict',
+                        'allow_unknown': False,
+                        'schema': {
+                            # Used by formats that support them, ignored by the others
+                            'quality': {'type': 'integer', 'min': 0, 'max': 100},  # jpg, webp, avif
+                            'lossless': {'type': 'boolean'},  # webp, avif
+                            'method': {'type': 'integer', 'min': 0, 'max': 6},  # webp: 0 fast .. 6 smallest
+                            'speed': {'type': 'integer', 'min': 0, 'max': 10},  # avif: 0 smallest .. 10 fast
+                        }
+                    }
                 }
             }
         }
@@ -111,6 +188,18 @@ class _Constants:
             }
         }
 
+    @staticmethod
+    def _get_optional_image_types() -> list:
+        """Formats that depend on how Pillow was built"""
+        types = []
+        for ext in ('webp', 'avif'):
+            try:
+                if features.check_module(ext):
+                    types.append(ext)
+            except ValueError:
+                pass  # Pillow is too old to know the module
+        return types
+
     @property
     def default_log_level(self):
         return self._default_log_level
@@ -0,0 +1,176 @@
+import os
+import resource
+import time
+
+from PIL import Image
+
+from archive_tools import is_archive
+from file_manager import FileManager, FileJob
+from image_handler import ImageHandler
+from image_handler.saver import get_image_format
+from logging_tools import get_logger
+from tools import scan_dir
+
+
+logger = get_logger()
+
+class RunEstimator:
+    """
+    Dry run of a FileManager config: projects wall time, peak memory and output size without writing anything.
+    - every image header is probed (no decoding) to get the pixel count of the whole input
+    - a sample of images spread over the size range is really processed in memory and timed
+    - the measured cost per pixel and output bytes per input byte are extrapolated to all files
+    """
+
+    def __init__(self, file_manager: FileManager, sample_size: int = 16) -> None:
+        if sample_size < 1:
+            raise ValueError('sample_size must be at least 1')
+        self.file_manager = file_manager
+        self.sample_size = sample_size
+        self.handler = ImageHandler()
+
+    def run(self) -> dict:
+        fm = self.file_manager
+        if is_archive(fm.input_dir):
+            raise ValueError('Estimates need an input directory, archives are not supported')
+        started = time.monotonic()
+
+        files = fm.get_input_files()
+        output_files, _ = scan_dir(fm.output_dir)
+        existing_files = set() if fm.clean_output_dir_flag else set(output_files)
+
+        images: list[tuple[FileJob, int, int, int]] = []  # job, input bytes, pixels, decoded bytes
+        other_bytes = 0
+        skipped = 0
+        unreadable = 0
+
+        for file in files:
+            job = fm._plan_file(file)
+            if job.target in existing_files and not fm.overwrite_flag:
+                skipped += 1
+                continue
+
+            size = file.stat().st_size
+            if job.media_type != 'image':
+                other_bytes += size if job.media_type is not None or fm.copy_other_flag else 0
+                continue
+
+            try:
+                with Image.open(file) as image:
+                    # Only the header is read until the pixels are accessed
+                    pixels = image.width * image.height
+                    decoded = pixels * len(image.getbands()) * (4 if image.mode in ('I', 'F') else 1)
+            except Exception as e:
+                logger.debug(f'Unable to probe {file}: {e}')
+                unreadable += 1
+                continue
+            images.append((job, size, pixels, decoded))
+
+        sample = self._measure(self._pick_sample(images))
+
+        total_pixels = sum(pixels for _, _, pixels, _ in images)
+        image_bytes = sum(size for _, size, _, _ in images)
+        cpu_seconds = total_pixels * sample['seconds_per_pixel']
+        peak_decoded = max((decoded for *_, decoded in images), default=0)
+
+        # A worker holds the source image, the transformed one and the encoded output at the same time
+        worker_peak_bytes = sample['baseline_rss_bytes'] + 3 * peak_decoded
+
+        cpu_count = os.cpu_count() or 1
+        worker_counts = sorted({1, 2, 4, 8, cpu_count})
+
+        return {
+            'files': len(files),
+            'images': len(images),
+            'other_files': len(files) - len(images) - skipped - unreadable,
+            'skipped_existing': skipped,
+            'unreadable': unreadable,
+            'input_bytes': image_bytes + other_bytes,
+            'total_megapixels': total_pixels / 1e6,
+            'sampled_images': sample['count'],
+            'seconds_per_megapixel': sample['seconds_per_pixel'] * 1e6,
+            'stage_shares': sample['stage_shares'],
+            'output_bytes': int(image_bytes * sample['output_ratio']) + other_bytes,
+            'cpu_seconds': cpu_seconds,
+            # Ideal scaling, capped by the number of cores of this machine
+            'wall_seconds': {w: cpu_seconds / min(w, cpu_count) for w in worker_counts},
+            'worker_peak_bytes': worker_peak_bytes,
+            'estimate_seconds': time.monotonic() - started,
+        }
+
+    def _pick_sample(self, images: list) -> list:
+        """Picks images evenly over the pixel count distribution, so both small and big files are timed"""
+        if len(images) <= self.sample_size:
+            return images
+        ordered = sorted(images, key=lambda item: (item[2], str(item[0].source)))
+        step = (len(ordered) - 1) / (self.sample_size - 1) if self.sample_size > 1 else 0
+        return [ordered[round(i * step)] for i in range(self.sample_size)]
+
+    def _measure(self, sample: list) -> dict:
+        operations = self.file_manager.media_ops.get('image', {})
+        plan = self.handler.transformer.compile(operations)
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        stages = {'load': 0.0, 'transform': 0.0, 'encode': 0.0}
+        pixels = 0
+        input_bytes = 0
+        output_bytes = 0
+
+        warmed_up = False
+        for job, size, job_pixels, _ in sample:
+            try:
+                if not warmed_up:
+                    # Calibration: the first run pays for plugin imports and lazy initialization, it isn't
+                    # counted. It's done on the first readable sample, so a broken file can't abort the estimate
+                    self._process(job, plan, {'load': 0.0, 'transform': 0.0, 'encode': 0.0})
+                    warmed_up = True
+                output_bytes += self._process(job, plan, stages)
+            except Exception as e:
+                logger.warning(f'Sample {job.source} failed: {e}')
+                continue
+            pixels += job_pixels
+            input_bytes += size
+
+        total = sum(stages.values())
+        return {
+            'count': len(sample),
+            'seconds_per_pixel': total / pixels if pixels else 0.0,
+            'output_ratio': output_bytes / input_bytes if input_bytes else 1.0,
+            'stage_shares': {stage: seconds / total if total else 0.0 for stage, seconds in stages.items()},
+            'baseline_rss_bytes': baseline_rss,
+        }
+
+    def _process(self, job: FileJob, plan: list, stages: dict) -> int:
+        t0 = time.perf_counter()
+        image = self.handler.loader.load(job.source)
+        t1 = time.perf_counter()
+        image = self.handler.transformer.apply(image, plan)
+        t2 = time.perf_counter()
+        encoded = self.handler.saver.save_bytes(image, get_image_format(job.target.suffix[1:]),
+                                                self.file_manager.media_ops.get('image', {}).get('encoder'))
+        t3 = time.perf_counter()
+
+        stages['load'] += t1 - t0
+        stages['transform'] += t2 - t1
+        stages['encode'] += t3 - t2
+        return len(encoded)
+
+
+def log_estimate(estimate: dict) -> None:
+    mb = 1024 * 1024
+    logger.info(f"Files: {estimate['files']} ({estimate['images']} images, {estimate['other_files']} other, "
+                f"{estimate['skipped_existing']} already processed, {estimate['unreadable']} unreadable)")
+    logger.info(f"Input: {estimate['input_bytes'] / mb:.1f} MB, {estimate['total_megapixels']:.1f} megapixels")
+    logger.info(f"Sampled {estimate['sampled_images']} images: {estimate['seconds_per_megapixel']:.3f} s/megapixel "
+                f"(" + ', '.join(f'{stage} {share:.0%}' for stage, share in estimate['stage_shares'].items()) + ")")
+    logger.info(f"Projected output: {estimate['output_bytes'] / mb:.1f} MB")
+    for workers, seconds in estimate['wall_seconds'].items():
+        logger.info(f"Projected wall time with {workers} workers: {_format_duration(seconds)}, "
+                    f"peak memory {workers * estimate['worker_peak_bytes'] / mb:.0f} MB")
+    logger.info(f"Estimate took {estimate['estimate_seconds']:.1f}s")
+
+
+def _format_duration(seconds: float) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f'{hours}h {minutes:02d}m {seconds:02d}s'
@@ -1,16 +1,34 @@
 from codecs import ignore_errors
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+import glob
+from typing import Iterator, NamedTuple, Optional
 import sys
+import time
 
+from archive_tools import is_archive, iter_members, ArchiveWriter, DirWriter, Member
+from base_classes import JobResult
+from constants import CONST
 from handler_factory import HandlerFactory
-from tools import clean_dir, copy_file
+from image_handler.loader import ICON_EXTS
+from image_handler.palette import get_shared_palette
+from job_queue import JobQueue, format_stats
+from tools import clean_dir, copy_file, shard_of, scan_dir
 from logging_tools import get_logger
+from metrics import get_metrics
 
 
 logger = get_logger()
+metrics = get_metrics()
+
+class FileJob(NamedTuple):
+    """Planned work for one input file. media_type is None for files that no handler takes"""
+    source: Path
+    target: Path
+    media_type: Optional[str]
+
 
 class FileManager:
-    def __init__(self, base_config: dict, ops_config: dict) -> None:
+    def __init__(self, base_config: dict, ops_config: dict, shard_index: int = 0, shard_count: int = 1) -> None:
         # Extracting params from config
         main: dict = base_config['main']
         self.input_dir = Path(main['input_dir_path'])
@@ -20,19 +38,59 @@ class FileManager:
         self.overwrite_flag: bool = main['overwrite_files']
         self.copy_other_flag: bool = main['copy_other_files']
         self.ignore_errors: bool = main['ignore_errors']
+        self.archive_compression: str = main['archive_compression']
+        self.archive_compresslevel: Optional[int] = main['archive_compresslevel']
+        self.stage_split: Optional[dict] = main['stage_split']
+        self.batch_size: int = main['batch_size']
+        self.sync_flag: bool = main['sync']
         self.media_exts = {k: v for k, v in base_config.items() if k != 'main'}
         self.media_ops = {k: v for k, v in ops_config.items()}
+        self.ext_table = self._build_ext_table()
+        self.icon_frames = self.media_ops.get('image', {}).get('icon_frames', 'best')
+        if self.icon_frames != 'best' and 'resize' in self.media_ops.get('image', {}):
+            logger.warning('resize is not applied to icons written frame by frame, frames keep their size')
+
+        # Sharding: every node processes only files whose relative path hashes to its shard index
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f'Shard index {shard_index} is out of range for {shard_count} shards')
+        self.shard_index = shard_index
+        self.shard_count = shard_count
 
         self.total_files = 0
         self.files_processed = 0
+        self.files_skipped = 0
+        self.files_copied = 0
+        self.failures: list[dict] = []
+        self.elapsed_seconds = 0.0
         self.current_file_number = 0
         self.prefix = ""
 
     def run(self):
-        if self.clean_output_dir_flag:
-            clean_dir(self.output_dir)
+        if self.sync_flag and (is_archive(self.input_dir) or is_archive(self.output_dir)):
+            raise ValueError('sync works with input and output directories, not archives')
+        if self.shard_count > 1 and is_archive(self.output_dir):
+            # Every shard would write the whole archive, and the last one to finish would replace the others
+            raise ValueError('Sharded runs need an output directory, shards can not share an output archive')
+
+        self._prepare_shared_palette()
+
+        if is_archive(self.input_dir) or is_archive(self.output_dir):
+            self._run_archive()
+            return
+
+        output_cleaned = False
+        if self.clean_output_dir_flag and self.sync_flag:
+            logger.info('clean_output_dir is replaced by sync, only orphaned outputs are deleted')
+        elif self.clean_output_dir_flag:
+            if self.shard_count > 1:
+                # Other nodes are writing to the same output dir, cleaning it would delete their results
+                logger.warning('clean_output_dir is ignored when running in shards')
+            else:
+                clean_dir(self.output_dir)
+                output_cleaned = True
 
-        files = self._get_input_files()
+        started = time.monotonic()
+        files = self.get_input_files()
 
         if not files:
             logger.warning('No files to process in the input directory.')
@@ -40,67 +98,568 @@ class FileManager:
 
         self.total_files = len(files)
 
+        # The output tree is listed once instead of checking every target and its directory separately
+        if output_cleaned:
+            existing_files, existing_dirs = set(), set()
+        else:
+            output_files, existing_dirs = scan_dir(self.output_dir)
+            existing_files = set(output_files)
+
+        if self.sync_flag:
+            jobs = self._sync(files, existing_files, existing_dirs)
+        else:
+            jobs = self._plan(files, existing_files)
+        self._make_dirs(jobs, existing_dirs)
+
+        job_count = len(jobs)
+        try:
+            if self.stage_split is not None:
+                jobs = self._run_staged(jobs)
+
+            for batch in self._batches(jobs):
+                if batch[0].media_type is not None:
+                    self._manage_batch(batch, job_count)
+                    continue
+
+                for job in batch:
+                    self._next_job(job_count)
+                    try:
+                        self._manage_job(job)
+                    except Exception as e:
+                        self._record_failure(job, e)
+                        if self.ignore_errors: pass
+                        else: raise
+        finally:
+            self.elapsed_seconds = time.monotonic() - started
+
+        logger.info(f"{self.files_processed}/{self.total_files} files processed")
+
+    def run_files(self, files: list[Path]) -> list[JobResult]:
+        """
+        Processes the given input files one by one, without cleaning or syncing the output dir, and returns
+        a result per processed file, in order. Failures are recorded and returned as results, not raised.
+        Files whose output exists are skipped unless overwrite_files is on, they are only counted
+        """
+        started = time.monotonic()
+        self._prepare_shared_palette()
+        self.total_files += len(files)
+
+        jobs = self._plan(files, None)
+        self._make_dirs(jobs, set())
+
+        results = []
+        try:
+            for job in jobs:
+                self._next_job(len(jobs))
+                try:
+                    results.append(self._manage_job(job))
+                except Exception as e:
+                    self._record_failure(job, e)
+                    results.append(JobResult(job.source, job.target, False, e))
+        finally:
+            self.elapsed_seconds += time.monotonic() - started
+
+        return results
+
+    def _sync(self, files: list[Path], existing_files: set[Path], existing_dirs: set[Path]) -> list[FileJob]:
+        """
+        Mirrors the input tree: deletes outputs no input maps to anymore (also the ones left behind by an
+        output_ext change) and directories they leave empty, then returns jobs for targets that are missing
+        or older than their input. existing_files and existing_dirs are updated in place
+        """
+        # Expected targets come from all input files, not the shard, so other nodes' outputs are kept
+        if self.shard_count > 1:
+            all_files, _ = scan_dir(self.input_dir, self.recursive_flag)
+        else:
+            all_files = files
+        expected: set[Path] = set()
+        frame_targets: set[tuple[Path, str, str]] = set()  # Icons written frame by frame: <stem>_<W>x<H><suffix>
+        for file in all_files:
+            job = self._plan_file(file)
+            if job.media_type is None and not self.copy_other_flag:
+                continue
+            expected.add(job.target)
+            if self._is_frame_job(job):
+                frame_targets.add((job.target.parent, job.target.stem, job.target.suffix))
+
+        orphans = [f for f in existing_files if f not in expected and _get_frame_key(f) not in frame_targets]
+        for orphan in orphans:
+            logger.info(f"Deleting orphaned output: {orphan}")
+            orphan.unlink(missing_ok=True)
+            existing_files.discard(orphan)
+
+        # Other shards may be about to write into a directory that is empty for now, so they are only removed
+        # by a single node. Deepest first, so a directory emptied by removing its subdirectories goes too
+        if self.shard_count == 1:
+            for dir_path in sorted(existing_dirs, key=lambda d: len(d.parts), reverse=True):
+                try:
+                    dir_path.rmdir()
+                except OSError:
+                    continue  # Not empty
+                logger.info(f"Deleted empty directory: {dir_path}")
+                existing_dirs.discard(dir_path)
+
+        jobs = []
+        up_to_date = 0
+        frame_index = self._index_frame_outputs(existing_files)
         for file in files:
-            self.current_file_number += 1
-            self.prefix = f'[{self.current_file_number}/{self.total_files}]'
-            try:
-                self._manage_file(file)
-            except Exception as e:
-                logger.error(f'{self.prefix} Failed to process {file}: {e}')
-                if self.ignore_errors: pass
-                else: raise
+            job = self._plan_file(file)
+            outputs = self._find_outputs(job, existing_files, frame_index)
+            if outputs and all(output.stat().st_mtime >= file.stat().st_mtime for output in outputs):
+                up_to_date += 1
+                continue
+            jobs.append(job)
+
+        self.files_skipped += up_to_date
+        metrics.inc('mm_files_total', up_to_date, result='skipped')
+        logger.info(f"Sync: {len(orphans)} orphaned outputs deleted, {up_to_date} up to date, {len(jobs)} to process")
+        return jobs
+
+    def _batches(self, jobs: list[FileJob]) -> Iterator[list[FileJob]]:
+        """Splits jobs into runs of up to batch_size consecutive jobs of the same media type"""
+        batch = []
+        for job in jobs:
+            if batch and (job.media_type != batch[0].media_type or len(batch) >= self.batch_size):
+                yield batch
+                batch = []
+            batch.append(job)
+        if batch:
+            yield batch
+
+    def _manage_batch(self, batch: list[FileJob], job_count: int) -> None:
+        """Hands a batch of one media type to its handler, which shares its setup across the batch"""
+        media_type = batch[0].media_type
+        try:
+            handler = HandlerFactory.get_handler(media_type)
+        except ValueError as e:
+            logger.error(f'Failed to get handler for {media_type}: {e}')
+            self.current_file_number += len(batch)
+            return
+
+        operations = self.media_ops.get(media_type, {})
+        results = handler.run_batch(((job.source, job.target) for job in batch), operations.copy())
+        for job, result in zip(batch, results):
+            self._next_job(job_count)
+            if result.error is not None:
+                self._record_failure(job, result.error)
+                if self.ignore_errors: continue
+                else: raise result.error
+
+            if result.success:
+                try:
+                    self._count_bytes(job, result.outputs)
+                except Exception as e:
+                    self._record_failure(job, e)
+                    if self.ignore_errors: continue
+                    else: raise
+
+                logger.info(f"{self.prefix} Processed file: {job.source} -> {job.target}")
+                self.files_processed += 1
+                metrics.inc('mm_files_total', result='processed')
+
+    def _next_job(self, job_count: int) -> None:
+        self.current_file_number += 1
+        self.prefix = f'[{self.current_file_number}/{job_count}]'
+        metrics.set('mm_queue_depth', job_count - self.current_file_number, queue='files', state='pending')
+
+    def _record_failure(self, job: FileJob, error: Exception) -> None:
+        logger.error(f'{self.prefix} Failed to process {job.source}: {error}')
+        self.failures.append({'file': str(job.source), 'error': f'{type(error).__name__}: {error}'})
+        metrics.inc('mm_files_total', result='failed')
+
+    def _run_staged(self, jobs: list[FileJob]) -> list[FileJob]:
+        """
+        Runs the image jobs through the stage-split pipeline, returns the other jobs for the regular loop
+        """
+        from image_handler.pipeline import StagedImagePipeline
+
+        # Icons written frame by frame have several outputs, they go through the regular loop
+        staged = [job for job in jobs if job.media_type == 'image' and not self._is_frame_job(job)]
+        images = [(job.source, job.target) for job in staged]
+        if not images:
+            return jobs
+
+        logger.info(f'Processing {len(images)} images in stage-split mode: ' +
+                    ', '.join(f'{k} {v}' for k, v in self.stage_split.items()))
+        operations = self.media_ops.get('image', {})
+
+        with StagedImagePipeline(**self.stage_split) as pipeline:
+            for source, target, error in pipeline.run(images, operations.copy()):
+                self._next_job(len(jobs))
+                job = FileJob(source, target, 'image')
+
+                if error is None:
+                    try:
+                        self._count_bytes(job, (target,))
+                    except Exception as e:
+                        error = e
+
+                if error is not None:
+                    self._record_failure(job, error)
+                    if self.ignore_errors: continue
+                    else: raise error
+
+                logger.info(f"{self.prefix} Processed file: {source} -> {target}")
+                self.files_processed += 1
+                metrics.inc('mm_files_total', result='processed')
+
+        staged_sources = {job.source for job in staged}
+        return [job for job in jobs if job.source not in staged_sources]
+
+    def enqueue(self, job_queue: JobQueue) -> int:
+        """Coordinator mode: puts input files into the job queue for workers"""
+        if is_archive(self.input_dir) or is_archive(self.output_dir):
+            raise ValueError('The job queue works with input and output directories, not archives')
+
+        if self.clean_output_dir_flag:
+            stats = job_queue.stats()
+            if stats['pending'] + stats['leased'] + stats['done'] + stats['failed'] == 0:
+                clean_dir(self.output_dir)
+            else:
+                # Enqueue is re-run to add new files, the outputs of finished jobs are never queued again
+                logger.warning('clean_output_dir is ignored, the job queue already has jobs')
+
+        files = self.get_input_files()
+        added = job_queue.add(f.relative_to(self.input_dir).as_posix() for f in files)
+
+        logger.info(f"{added} files queued ({len(files) - added} were already in the queue)")
+        return added
+
+    def run_worker(self, job_queue: JobQueue, worker_id: str, batch_size: int = 16,
+                   poll_interval: float = 5.0, report_interval: float = 30.0) -> None:
+        """
+        Worker mode: claims jobs from the queue until it is drained.
+        Waits while other workers hold leases, since their jobs come back to the queue if they crash
+        """
+        started = time.monotonic()
+        last_report = started
+        self.prefix = f'[{worker_id}]'
+        self._prepare_shared_palette()
+
+        try:
+            while True:
+                jobs = job_queue.claim(worker_id, batch_size)
+
+                if metrics.enabled or not jobs:
+                    stats = job_queue.stats()
+                    metrics.set('mm_queue_depth', stats['pending'], queue='job_queue', state='pending')
+                    metrics.set('mm_queue_depth', stats['leased'], queue='job_queue', state='leased')
+
+                if not jobs:
+                    if stats['backlog'] == 0:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                for number, (job_id, relative_path) in enumerate(jobs):
+                    file = self.input_dir / relative_path
+                    self.total_files += 1
+                    try:
+                        self._manage_file(file)
+                    except Exception as e:
+                        logger.error(f'{self.prefix} Failed to process {file}: {e}')
+                        self.failures.append({'file': str(file), 'error': f'{type(e).__name__}: {e}'})
+                        metrics.inc('mm_files_total', result='failed')
+                        job_queue.fail(job_id, worker_id, f'{type(e).__name__}: {e}')
+                        if not self.ignore_errors:
+                            raise
+                    else:
+                        job_queue.complete(job_id, worker_id)
+
+                    remaining = [job_id for job_id, _ in jobs[number + 1:]]
+                    if remaining:
+                        job_queue.extend(remaining, worker_id)
+
+                if time.monotonic() - last_report >= report_interval:
+                    last_report = time.monotonic()
+                    logger.info(f'{self.prefix} Queue: {format_stats(job_queue.stats())}')
+        finally:
+            self.elapsed_seconds = time.monotonic() - started
+
+        logger.info(f"{self.prefix} {self.files_processed}/{self.total_files} files processed by this worker")
+
+    def _run_archive(self) -> None:
+        """
+        Streams files from the input source (tar, zip or directory) to the output (tar, zip or directory)
+        member by member, without extracting anything to disk. Images are processed in memory
+        """
+        # Members are handled one at a time as they are read, the batch and stage-split pipelines and
+        # per-frame icon outputs need the files planned up front
+        ignored = [name for name, is_set in (
+            ('batch_size', self.batch_size != CONST.default_base_config_params['main']['batch_size']),
+            ('stage_split', self.stage_split is not None),
+            ('icon_frames', self.icon_frames != 'best'),
+        ) if is_set]
+        if ignored:
+            logger.warning(f"{', '.join(ignored)} not supported when reading or writing archives, ignored")
+
+        if is_archive(self.output_dir):
+            if self.output_dir.exists() and not self.overwrite_flag:
+                logger.warning(f'Skipping run, output archive already exists: {self.output_dir}')
+                return
+            writer = ArchiveWriter(self.output_dir, self.archive_compression, self.archive_compresslevel)
+            existing_files = set()
+        else:
+            if self.clean_output_dir_flag and self.shard_count == 1:
+                clean_dir(self.output_dir)
+            output_files, _ = scan_dir(self.output_dir)
+            existing_files = {f.relative_to(self.output_dir).as_posix() for f in output_files}
+            writer = DirWriter(self.output_dir)
+
+        handler = HandlerFactory.get_handler('image')
+        started = time.monotonic()
+
+        try:
+            with writer:
+                for member in self._iter_members():
+                    if self.shard_count > 1 and shard_of(member.path, self.shard_count) != self.shard_index:
+                        continue
+
+                    self.total_files += 1
+                    self.prefix = f'[{self.total_files}]'
+                    try:
+                        self._manage_member(member, writer, handler, existing_files)
+                    except Exception as e:
+                        logger.error(f'{self.prefix} Failed to process {member.path}: {e}')
+                        self.failures.append({'file': str(member.path), 'error': f'{type(e).__name__}: {e}'})
+                        metrics.inc('mm_files_total', result='failed')
+                        if self.ignore_errors: pass
+                        else: raise
+        finally:
+            self.elapsed_seconds = time.monotonic() - started
 
         logger.info(f"{self.files_processed}/{self.total_files} files processed")
 
-    def _get_input_files(self) -> list[Path]:
-        if self.recursive_flag:
-            files = self.input_dir.rglob('*')
+    def _iter_members(self):
+        if is_archive(self.input_dir):
+            yield from iter_members(self.input_dir, self.recursive_flag)
+            return
+
+        files, _ = scan_dir(self.input_dir, self.recursive_flag)
+        for file in files:
+            relative_path = PurePosixPath(file.relative_to(self.input_dir).as_posix())
+            yield Member(relative_path, file.read_bytes(), file.stat().st_mtime)
+
+    def _manage_member(self, member: Member, writer, handler, existing_files: set[str]) -> None:
+        media_type, output_ext = self.ext_table.get(member.path.suffix[1:].lower(), (None, None))
+        target = member.path.with_suffix(f".{output_ext}") if media_type is not None else member.path
+
+        if not self.overwrite_flag and target.as_posix() in existing_files:
+            logger.info(f"Skipping file (already exists): {target}")
+            self.files_skipped += 1
+            metrics.inc('mm_files_total', result='skipped')
+            return
+
+        metrics.inc('mm_input_bytes_total', len(member.data))
+
+        if media_type == 'image':
+            logger.info(f"{self.prefix} Processing file: {member.path} -> {target}")
+            data = handler.run_bytes(member.data, self.media_ops.get(media_type, {}).copy(), output_ext)
+            writer.add(target, data, member.mtime)
+            self.files_processed += 1
+            metrics.inc('mm_output_bytes_total', len(data))
+            metrics.inc('mm_files_total', result='processed')
+            return
+
+        if media_type is not None:
+            logger.warning(f"{self.prefix} {media_type} files can't be processed from archives, skipping {member.path}")
+        else:
+            logger.info(f"{self.prefix} Skipping file: {member.path}")
+
+        if self.copy_other_flag:
+            writer.add(target, member.data, member.mtime)
+            self.files_copied += 1
+            metrics.inc('mm_output_bytes_total', len(member.data))
+            metrics.inc('mm_files_total', result='copied')
         else:
-            files = self.input_dir.glob('*')
+            self.files_skipped += 1
+            metrics.inc('mm_files_total', result='skipped')
+
+    def get_summary(self) -> dict:
+        return {
+            'input_dir_path': str(self.input_dir),
+            'output_dir_path': str(self.output_dir),
+            'shard_index': self.shard_index,
+            'shard_count': self.shard_count,
+            'total_files': self.total_files,
+            'files_processed': self.files_processed,
+            'files_skipped': self.files_skipped,
+            'files_copied': self.files_copied,
+            'files_failed': len(self.failures),
+            'elapsed_seconds': self.elapsed_seconds,
+            'failures': self.failures.copy(),
+        }
+
+    def get_input_files(self) -> list[Path]:
+        """Input files of this node: all of them, or the ones of its shard"""
+        files, _ = scan_dir(self.input_dir, self.recursive_flag)
+
+        if self.shard_count > 1:
+            files = [f for f in files
+                     if shard_of(f.relative_to(self.input_dir), self.shard_count) == self.shard_index]
 
-        files = [f for f in files if f.is_file()]
-        
         return files
 
-    def _manage_file(self, file: Path) -> None:
+    def _prepare_shared_palette(self) -> None:
+        """Puts the shared palette of an adaptive_palette run into the image operations, building it if not cached"""
+        operations = self.media_ops.get('image', {})
+        params = operations.get('shared_palette')
+        if params is None or operations.get('color_mode') != 'adaptive_palette':
+            return
+        if is_archive(self.input_dir):
+            logger.warning('shared_palette needs an input directory, every image gets its own palette')
+            return
+
+        # Sampled from all files, not the shard, so every node of a run gets the same palette
+        files, _ = scan_dir(self.input_dir, self.recursive_flag)
+        images = [f for f in files if self.ext_table.get(f.suffix[1:].lower(), (None,))[0] == 'image']
+        if not images:
+            return
+
+        cache_dir = Path(params['cache_dir']) if 'cache_dir' in params else None
+        palette = get_shared_palette(images, operations, params.get('sample_size', 32), params.get('colors', 256),
+                                     cache_dir)
+        self.media_ops['image'] = {**operations, 'palette': palette}
+
+    def _build_ext_table(self) -> dict[str, tuple[str, str]]:
+        """Maps input extension -> (media_type, output_ext). The first media type listing an extension wins"""
+        ext_table = {}
+        for media_type, params in self.media_exts.items():
+            for extension in params['input_exts']:
+                output_ext = extension if params['output_ext'] == 'native' else params['output_ext']
+                ext_table.setdefault(extension, (media_type, output_ext))
+        return ext_table
+
+    def _plan_file(self, file: Path) -> FileJob:
         relative_path = file.relative_to(self.input_dir)
         target_path = self.output_dir / relative_path
 
-        if not target_path.parent.exists():
-            target_path.parent.mkdir(parents=True, exist_ok=True)
+        media_type, output_ext = self.ext_table.get(file.suffix[1:].lower(), (None, None))
+        if media_type is not None:
+            target_path = target_path.with_suffix(f".{output_ext}")
 
-        if target_path.exists() and not self.overwrite_flag:
-            logger.info(f"Skipping file (already exists): {target_path}")
-            return
+        return FileJob(file, target_path, media_type)
 
-        extension = file.suffix[1:].lower()
+    def _plan(self, files: list[Path], existing_files: Optional[set[Path]]) -> list[FileJob]:
+        """
+        Resolves target paths and drops files whose target exists (unless overwriting).
+        existing_files is the listing of the output tree, None checks every target on disk instead
+        """
+        jobs = []
+        frame_index = self._index_frame_outputs(existing_files) if not self.overwrite_flag else {}
+        for file in files:
+            job = self._plan_file(file)
 
-        for media_type, params in self.media_exts.items():
-            if extension in params['input_exts']:
-                output_ext = params['output_ext']
-                if output_ext == 'native':
-                    output_ext = extension
-                target_path = target_path.with_suffix(f".{output_ext}")
-                self._delegate_media_file(file, target_path, media_type)
-                return
+            if not self.overwrite_flag:
+                if self._find_outputs(job, existing_files, frame_index):
+                    logger.info(f"Skipping file (already exists): {job.target}")
+                    self.files_skipped += 1
+                    metrics.inc('mm_files_total', result='skipped')
+                    continue
+
+            jobs.append(job)
+
+        return jobs
 
-        logger.info(f"{self.prefix} Skipping file: {file}")
+    def _is_frame_job(self, job: FileJob) -> bool:
+        return job.media_type == 'image' and self.icon_frames != 'best' and job.source.suffix[1:].lower() in ICON_EXTS
+
+    def _index_frame_outputs(self, existing_files: Optional[set[Path]]) -> dict[tuple[Path, str, str], list[Path]]:
+        """Groups <stem>_<W>x<H> outputs of the listing by the target they belong to, if icons are written by frame"""
+        index = {}
+        if self.icon_frames != 'best' and existing_files is not None:
+            for file in existing_files:
+                key = _get_frame_key(file)
+                if key is not None:
+                    index.setdefault(key, []).append(file)
+        return index
+
+    def _find_outputs(self, job: FileJob, existing_files: Optional[set[Path]],
+                      frame_index: dict[tuple[Path, str, str], list[Path]]) -> list[Path]:
+        """
+        Outputs of the job that already exist. existing_files is the listing of the output tree,
+        None checks on disk instead. Icons written frame by frame have one output per frame
+        """
+        target = job.target
+        if not self._is_frame_job(job):
+            exists = target in existing_files if existing_files is not None else target.exists()
+            return [target] if exists else []
+
+        key = (target.parent, target.stem, target.suffix)
+        if existing_files is not None:
+            return frame_index.get(key, [])
+        return [f for f in target.parent.glob(f'{glob.escape(target.stem)}_*{target.suffix}') if _get_frame_key(f) == key]
+
+    def _make_dirs(self, jobs: list[FileJob], existing_dirs: set[Path]) -> None:
+        """Creates all target directories in one go, each missing directory once"""
+        needed = {job.target.parent for job in jobs if job.media_type is not None or self.copy_other_flag}
+        for dir_path in sorted(needed - existing_dirs - {self.output_dir}):
+            dir_path.mkdir(parents=True, exist_ok=True)
+
+    def _manage_file(self, file: Path) -> None:
+        """Plans and processes a single file, for callers that get files one by one"""
+        jobs = self._plan([file], None)
+        if jobs:
+            self._make_dirs(jobs, set())
+            self._manage_job(jobs[0])
+
+    def _manage_job(self, job: FileJob) -> JobResult:
+        """Processes or copies the file of the job, raises on failure"""
+        if job.media_type is not None:
+            result = self._delegate_media_file(job.source, job.target, job.media_type)
+            if result.success:
+                self._count_bytes(job, result.outputs)
+                metrics.inc('mm_files_total', result='processed')
+            return result
+
+        logger.info(f"{self.prefix} Skipping file: {job.source}")
 
         if self.copy_other_flag:
-            copy_file(file, target_path)
+            try:
+                copy_file(job.source, job.target)
+            except Exception as e:
+                metrics.inc('mm_errors_total', stage='copy', exception=type(e).__name__)
+                raise
+            self.files_copied += 1
+            self._count_bytes(job, (job.target,))
+            metrics.inc('mm_files_total', result='copied')
+            return JobResult(job.source, job.target, True, None, (job.target,))
+
+        self.files_skipped += 1
+        metrics.inc('mm_files_total', result='skipped')
+        return JobResult(job.source, job.target, False)
+
+    def _count_bytes(self, job: FileJob, outputs: tuple[Path, ...]) -> None:
+        # Costs a stat per file, so only done when somebody is collecting metrics
+        if metrics.enabled:
+            metrics.inc('mm_input_bytes_total', job.source.stat().st_size)
+            metrics.inc('mm_output_bytes_total', sum(output.stat().st_size for output in outputs))
 
-    def _delegate_media_file(self, file: Path, target_path: Path, media_type: str) -> None:
+    def _delegate_media_file(self, file: Path, target_path: Path, media_type: str) -> JobResult:
+        """Returns the result of the handler, raises the error of a failed job"""
         try:
             handler = HandlerFactory.get_handler(media_type)
         except ValueError as e:
             logger.error(f'Failed to get handler for {media_type}: {e}')
-            return
+            return JobResult(file, target_path, False)
 
         operations = self.media_ops.get(media_type, {})
 
         logger.info(f"{self.prefix} Processing file: {file} -> {target_path}")
 
-        success = handler.run(file, target_path, operations.copy())
+        result = next(handler.run_batch([(file, target_path)], operations.copy()))
+        if result.error is not None:
+            raise result.error
 
-        if success:
+        if result.success:
             self.files_processed += 1
+        return result
+
+
+def _get_frame_key(file: Path) -> Optional[tuple[Path, str, str]]:
+    """(directory, stem, suffix) of the target a <stem>_<W>x<H><suffix> frame output belongs to"""
+    stem, _, size = file.stem.rpartition('_')
+    width, _, height = size.partition('x')
+    if stem and width.isdigit() and height.isdigit():
+        return file.parent, stem, file.suffix
+    return None
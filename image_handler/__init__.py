@@ -1,16 +1,20 @@
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Iterable, Iterator
+import time
 
 from PIL import Image
 
 from logging_tools import get_logger
-from base_classes import MediaHandler
-from .loader import ImageLoader
+from metrics import get_metrics
+from base_classes import MediaHandler, JobResult, BytesResult
+from .loader import ImageLoader, ICON_EXTS, get_icon_sizes
 from .transformer import ImageTransformer
-from .saver import ImageSaver
+from .saver import ImageSaver, SaveFormats, get_image_format
 
 
 logger = get_logger()
+metrics = get_metrics()
 
 class ImageHandler(MediaHandler):
     def __init__(self):
@@ -23,39 +27,189 @@ class ImageHandler(MediaHandler):
         self.operations: Optional[dict] = None
 
         self.image: Optional[Image.Image] = None
+        self.outputs: list[Path] = []  # Files written by the last job, several for icons written frame by frame
+        self.stage_seconds: dict[str, float] = {}  # Time the last job spent in load, transform and save
 
     def run(self, input_path: Path, target_path: Path, operations: dict) -> bool: # True if success
         self.input_path = input_path
         self.target_path = target_path
         self.operations = operations
+        self.outputs = []
+        self.stage_seconds = {}
+
+        icon_frames = self.operations.get('icon_frames', 'best')
+        if icon_frames != 'best' and self.input_path.suffix[1:].lower() in ICON_EXTS:
+            return self.run_frames(icon_frames)
+
+        return self._run_one(min_size=get_min_size(self.operations))
+
+    def run_frames(self, icon_frames, formats: Optional[SaveFormats] = None) -> bool:
+        """
+        Writes frames of a multi-resolution icon as separate outputs named <stem>_<width>x<height>.
+        icon_frames is 'all' or a list of frame widths. Frames keep their size, resize is not applied
+        """
+        plan = self.transformer.compile({k: v for k, v in self.operations.items() if k != 'resize'})
+
+        sizes = sorted(get_icon_sizes(self.input_path))
+
+        if icon_frames != 'all':
+            missing = set(icon_frames) - {width for width, _ in sizes}
+            if missing:
+                logger.warning(f"{self.input_path} has no frames of width {sorted(missing)}, available: {sizes}")
+            sizes = [size for size in sizes if size[0] in icon_frames]
+
+        target_path = self.target_path
+        for width, height in sizes:
+            self.target_path = target_path.with_name(f'{target_path.stem}_{width}x{height}{target_path.suffix}')
+            self._run_one(frame=(width, height), plan=plan, formats=formats)
+        self.target_path = target_path
 
-        try:
-            self.load()
-        except Exception as e:
-            logger.error(f"Error loading image {self.input_path}: {e}")
-            raise
-
-        try:
-            self.transform()
-        except Exception as e:
-            logger.error(f"Error transforming image {self.input_path}: {e}")
-            raise
+        return True
 
+    def run_batch(self, jobs: Iterable[tuple[Path, Path]], operations: dict) -> Iterator[JobResult]:
+        """
+        Processes many files with the same operations. The transform plan, the resize target and the output
+        formats are resolved once for the whole batch. Icons written frame by frame go through run_frames
+        """
+        self.operations = operations
+        plan = self.transformer.compile(self.operations)
+        formats = SaveFormats(self.operations.get('encoder'))
+        min_size = get_min_size(self.operations)
+        icon_frames = self.operations.get('icon_frames', 'best')
+
+        for input_path, target_path in jobs:
+            self.input_path = input_path
+            self.target_path = target_path
+            self.outputs = []
+            self.stage_seconds = {}
+            try:
+                if icon_frames != 'best' and self.input_path.suffix[1:].lower() in ICON_EXTS:
+                    success = self.run_frames(icon_frames, formats)
+                else:
+                    success = self._run_one(plan=plan, formats=formats, min_size=min_size)
+            except Exception as e:
+                yield JobResult(input_path, target_path, False, e, tuple(self.outputs), self.stage_seconds.copy())
+            else:
+                yield JobResult(input_path, target_path, success, None, tuple(self.outputs), self.stage_seconds.copy())
+
+    def _run_one(self, frame: Optional[tuple[int, int]] = None, plan: Optional[list] = None,
+                 formats: Optional[SaveFormats] = None, min_size: Optional[tuple[int, int]] = None) -> bool:
         try:
-            self.save()
-        except Exception as e:
-            logger.error(f"Error saving image {self.input_path}: {e}")
-            raise
+            try:
+                with self._timed('load'):
+                    self.load(frame, min_size)
+            except Exception as e:
+                logger.error(f"Error loading image {self.input_path}: {e}")
+                metrics.inc('mm_errors_total', stage='load', exception=type(e).__name__)
+                raise
+            mapped_image = self.image if self.loader.mapping is not None else None
+
+            try:
+                with self._timed('transform'):
+                    if plan is None:
+                        self.transform()
+                    else:
+                        self.image = self.transformer.apply(self.image, plan)
+            except Exception as e:
+                logger.error(f"Error transforming image {self.input_path}: {e}")
+                metrics.inc('mm_errors_total', stage='transform', exception=type(e).__name__)
+                raise
+
+            if self.image is mapped_image and mapped_image is not None:
+                # No operation made a new image. Saving the mapped pixels would write a file that may be the
+                # input itself, truncating the file under the map (SIGBUS). The pixels are copied off it first
+                self.image = self.image.copy()
+
+            try:
+                with self._timed('save'):
+                    if formats is None:
+                        self.save()
+                    else:
+                        self.saver.save_as(self.image, self.target_path, *formats.get(self.target_path))
+            except Exception as e:
+                logger.error(f"Error saving image {self.input_path}: {e}")
+                metrics.inc('mm_errors_total', stage='save', exception=type(e).__name__)
+                raise
+            self.outputs.append(self.target_path)
+        finally:
+            # The pixels of mapped inputs live in the map, it's kept open until the image is saved
+            self.loader.release()
 
         logger.debug(f"Successfully processed image: {self.input_path} -> {self.target_path}")
         return True
 
-    def load(self) -> None:
-        self.image = self.loader.load(self.input_path)
+    @contextmanager
+    def _timed(self, stage: str):
+        """Adds the time of the block to the stage of the job and to the mm_stage_seconds histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            metrics.observe('mm_stage_seconds', seconds, stage=stage)
+
+    def run_bytes(self, data, operations: dict, output_ext: str) -> bytes:
+        """
+        In-memory variant of run: takes encoded bytes or a binary buffer and returns encoded bytes.
+        output_ext 'native' keeps the format of the input
+        """
+        result = next(self.run_bytes_batch([data], operations, output_ext))
+        if result.error is not None:
+            raise result.error
+        return result.data
+
+    def run_bytes_batch(self, items: Iterable, operations: dict, output_ext: str) -> Iterator[BytesResult]:
+        """
+        Processes many in-memory images with the same operations, yields a result per item in order.
+        A failed item doesn't stop the batch. The transform plan and the output format are resolved once
+        """
+        self.operations = operations
+        plan = self.transformer.compile(self.operations)
+        image_format = None if output_ext == 'native' else get_image_format(output_ext)
+        encoder_params = self.operations.get('encoder')
+        min_size = get_min_size(self.operations)
+
+        for number, data in enumerate(items):
+            try:
+                self.image = self.loader.load_bytes(data, min_size)
+            except Exception as e:
+                logger.error(f"Error loading image #{number} from buffer: {e}")
+                yield BytesResult(None, e)
+                continue
+
+            source_format = self.image.format
+
+            try:
+                self.image = self.transformer.apply(self.image, plan)
+            except Exception as e:
+                logger.error(f"Error transforming image #{number} from buffer: {e}")
+                yield BytesResult(None, e)
+                continue
+
+            try:
+                result = self.saver.save_bytes(self.image, image_format or source_format, encoder_params)
+            except Exception as e:
+                logger.error(f"Error encoding image #{number} from buffer: {e}")
+                yield BytesResult(None, e)
+                continue
+
+            yield BytesResult(result)
+
+    def load(self, frame: Optional[tuple[int, int]] = None, min_size: Optional[tuple[int, int]] = None) -> None:
+        """frame picks an icon frame by size, min_size (the resize target) the smallest one that covers it"""
+        self.image = self.loader.load(self.input_path, min_size, frame)
 
     def transform(self) -> None:
         self.image = self.transformer.transform(self.image, self.operations)
 
     def save(self) -> None:
-        self.saver.save(self.image, self.target_path)
+        self.saver.save(self.image, self.target_path, self.operations.get('encoder'))
+
 
+def get_min_size(operations: dict) -> Optional[tuple[int, int]]:
+    """The resize target, the smallest source size that doesn't need upscaling"""
+    resize = operations.get('resize')
+    if not resize:
+        return None
+    return resize['width'], resize['height']
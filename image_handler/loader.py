@@ -1,15 +1,186 @@
+import io
 import logging
+import mmap
 from pathlib import Path
+from typing import BinaryIO, Optional, Union
 
-from PIL import Image
+from PIL import Image, IcoImagePlugin
 
 from base_classes import Loader
 
 
+# Uncompressed formats whose pixel data can be used right from a memory map
+_MAPPABLE_EXTS = ('bmp', 'dib', 'sgi', 'msp')
+# Formats that embed several resolutions of the same picture
+ICON_EXTS = ('ico', 'icns')
+
+
+def get_frame_sizes(image: Image.Image) -> dict[tuple[int, int], tuple]:
+    """Maps the pixel size of every frame of an opened ICO/ICNS file to the key that selects it"""
+    match image.format:
+        case 'ICO': return {size: size for size in image.info['sizes']}
+        case 'ICNS': return {(w * scale, h * scale): (w, h, scale) for w, h, scale in image.info['sizes']}
+        case _: return {image.size: image.size}
+
+def get_icon_sizes(input_path: Path) -> list[tuple[int, int]]:
+    """
+    Pixel sizes of the frames of an ICO/ICNS file. ICO sizes come from its directory:
+    Image.open would decode the largest frame right away
+    """
+    with open(input_path, 'rb') as f:
+        if input_path.suffix[1:].lower() == 'ico':
+            return list(IcoImagePlugin.IcoFile(f).sizes())
+        with Image.open(f) as image:
+            return list(get_frame_sizes(image))
+
+def pick_frame_size(sizes, min_size: tuple[int, int]) -> tuple[int, int]:
+    """The smallest frame that is at least min_size on both sides, the largest one if none is"""
+    covering = [size for size in sizes if size[0] >= min_size[0] and size[1] >= min_size[1]]
+    if covering:
+        return min(covering, key=lambda size: size[0] * size[1])
+    return max(sizes, key=lambda size: size[0] * size[1])
+
+def select_frame(image: Image.Image, size: tuple[int, int]) -> None:
+    """Makes the next load() of an opened ICO/ICNS file decode the frame of that pixel size"""
+    key = get_frame_sizes(image)[size]
+    match image.format:
+        case 'ICO':
+            image.size = key
+        case 'ICNS':
+            image.best_size = key
+            image.size = size
+
+
 class ImageLoader(Loader):
-    def load(self, input_path: Path) -> Image.Image:
+    def __init__(self):
+        super().__init__()
+        self.mapping: Optional[mmap.mmap] = None
+
+    def load(self, input_path: Path, min_size: Optional[tuple[int, int]] = None,
+             frame: Optional[tuple[int, int]] = None) -> Image.Image:
+        """
+        For ICO/ICNS inputs frame picks the embedded image by pixel size. Without it min_size (the resize
+        target) picks the smallest frame that covers it instead of Pillow's default, the largest one
+        """
         self.input_path = input_path
+        self.release()
+
+        if self.input_path.suffix[1:].lower() in _MAPPABLE_EXTS:
+            image = self._load_mapped()
+            if image is not None:
+                logging.debug(f"Image mapped from {self.input_path}")
+                return image
+
+        if self.input_path.suffix[1:].lower() == 'ico' and (min_size or frame):
+            with open(self.input_path, 'rb') as f:
+                image = self._load_ico_frame(f, min_size, frame)
+                logging.debug(f"Image loaded from {self.input_path}")
+                return image
+
         with Image.open(self.input_path) as file:
+            self._select_frame(file, min_size, frame)
             image = file.copy()
             logging.debug(f"Image loaded from {self.input_path}")
             return image
+
+    def load_bytes(self, data: Union[bytes, bytearray, memoryview, BinaryIO],
+                   min_size: Optional[tuple[int, int]] = None) -> Image.Image:
+        """Loads an image from encoded bytes or a binary buffer, without touching the filesystem"""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = io.BytesIO(data)
+        elif not hasattr(data, 'read'):
+            raise TypeError("IE: data must be bytes or a binary buffer")
+
+        # Decoding a buffer needs no copy: there is no file handle to release, the buffer is in memory anyway
+        image = Image.open(data)
+        self._select_frame(image, min_size, None)
+        image.load()
+        logging.debug(f"Image loaded from a {image.format} buffer")
+        return image
+
+    @staticmethod
+    def _load_ico_frame(f: BinaryIO, min_size: Optional[tuple[int, int]],
+                        frame: Optional[tuple[int, int]]) -> Image.Image:
+        """Image.open decodes the largest ICO frame right away, reading the directory first skips that"""
+        ico = IcoImagePlugin.IcoFile(f)
+        frame = frame or pick_frame_size(ico.sizes(), min_size)
+        image = ico.getimage(frame)
+        image.load()
+        logging.debug(f"Frame {frame[0]}x{frame[1]} selected from ICO sizes {sorted(ico.sizes())}")
+        return image
+
+    @staticmethod
+    def _select_frame(image: Image.Image, min_size: Optional[tuple[int, int]],
+                      frame: Optional[tuple[int, int]]) -> None:
+        if image.format not in ('ICO', 'ICNS'):
+            return
+        if frame is None and min_size is not None:
+            frame = pick_frame_size(get_frame_sizes(image), min_size)
+        if frame is not None:
+            select_frame(image, frame)
+            logging.debug(f"Frame {frame[0]}x{frame[1]} selected from {image.format} sizes {sorted(get_frame_sizes(image))}")
+
+    def release(self) -> None:
+        """
+        Drops the memory map of the last loaded image. Call it once the image is saved.
+        If the image is still referenced the map stays open until the image is freed
+        """
+        if self.mapping is None:
+            return
+        try:
+            self.mapping.close()
+        except BufferError:
+            pass  # Pixels of a live image point into the map
+        self.mapping = None
+
+    def _load_mapped(self) -> Optional[Image.Image]:
+        """
+        Builds the image on a read-only memory map of the file, nothing is read up front.
+        When the stored layout is the in-memory layout (8-bit grey/palette BMP, grey SGI) the image uses
+        the mapped pixels directly. Other raw layouts (BGR rows, planar SGI bands, 1-bit) are unpacked
+        from the map in one pass. Returns None when the file is compressed or the layout is unknown.
+        Like any mapped reader, the directly mapped layouts rely on nobody else truncating the input until
+        release(). The handler copies the pixels off the map before it writes anything itself
+        """
+        with open(self.input_path, 'rb') as f:
+            # Only the header is parsed here, pixels are never decoded by the probe
+            with Image.open(f) as probe:
+                mode, size, tiles, info = probe.mode, probe.size, probe.tile, probe.info.copy()
+                palette = probe.palette
+
+            if not tiles or any(tile[0] != 'raw' or tuple(tile[1]) != (0, 0) + size for tile in tiles):
+                return None
+
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(mapping)
+        try:
+            if len(tiles) == 1:
+                image = self._map_tile(mode, size, view, tiles[0])
+            else:
+                # Planar layout, one tile per band
+                image = Image.merge(mode, [self._map_tile('L', size, view, tile) for tile in tiles])
+        except ValueError as e:
+            logging.debug(f"Unable to map {self.input_path}, falling back to a regular load: {e}")
+            image = None
+
+        if image is None:
+            # Outside of the except block: its traceback holds slices of the view until the block ends
+            view.release()
+            mapping.close()
+            return None
+
+        if mode == 'P' and palette is not None:
+            image.putpalette(palette.palette, palette.rawmode or palette.mode)
+        image.info = info
+
+        self.mapping = mapping
+        return image
+
+    @staticmethod
+    def _map_tile(mode: str, size: tuple[int, int], view: memoryview, tile) -> Image.Image:
+        args = tile[3] if isinstance(tile[3], tuple) else (tile[3],)
+        rawmode = args[0]
+        if mode == 'L' and len(rawmode) == 1 and rawmode != 'L':
+            rawmode = 'L'  # A band of a planar image, e.g. 'R' in SGI
+        return Image.frombuffer(mode, size, view[tile[2]:], 'raw', rawmode, *args[1:])
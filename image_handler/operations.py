@@ -1,5 +1,8 @@
 from PIL import Image
-from typing import Union
+from typing import Optional, Union
+
+from .palette import map_to_palette, quantize
+from .resize_backends import get_resize_backend
 
 
 class ImageResizer:
@@ -11,8 +14,9 @@ class ImageResizer:
         self.target_height = params.get('height')
         self.target_size = (self.target_width, self.target_height)
         self.method = params.get('method')
-        self.resample_str: str = params.get('resample')
+        self.resample_str: str = params.get('resampling') or params.get('resample')
         self.resample: int = Image.Resampling.LANCZOS
+        self.backend: str = params.get('resize_backend')
         self.offset: tuple[float, float] = params.get('offset') or (0.5, 0.5)
         # Tuple (x, y) where x and y are between 0 and 1 representing the position of the resized image.
         # For example, (0.5, 0.5) centers the image, (0, 0) aligns the image to the top-left corner,
@@ -37,7 +41,7 @@ class ImageResizer:
             self.convert_resample()
 
         match self.method:
-            case None: self.resize_default()
+            case None | 'default': self.resize_default()
             case 'stretch': self.resize_stretch()
             case 'fit': self.resize_fit()
             case 'fill': self.resize_fill()
@@ -73,6 +77,11 @@ class ImageResizer:
             case _: raise ValueError(f'Unknown resampling method: {self.resample}')
         '''
 
+    def resize_image(self, image: Image.Image, size: tuple[int, int]) -> Image.Image:
+        """Resizes with the configured backend, 'auto' picks one by the scale factor of this call"""
+        backend = get_resize_backend(self.backend, image.size, size, self.resample, image.mode)
+        return backend.resize(image, size, self.resample)
+
     def resize_default(self):
         self.resize_stretch()
 
@@ -80,7 +89,7 @@ class ImageResizer:
         """
         Stretch the image to the given width and height, ignoring the original aspect ratio.
         """
-        self.image = self.image.resize(self.target_size, self.resample)
+        self.image = self.resize_image(self.image, self.target_size)
 
     def resize_fit(self):
         """
@@ -102,7 +111,7 @@ class ImageResizer:
             new_height = th
 
         # Resize image while preserving aspect ratio
-        self.image = self.image.resize((new_width, new_height), self.resample)
+        self.image = self.resize_image(self.image, (new_width, new_height))
 
     def resize_fill(self):
         """
@@ -125,7 +134,7 @@ class ImageResizer:
             new_height = int(tw / aspect_ratio)
 
         # Resize image while preserving aspect ratio
-        resized_image = self.image.resize((new_width, new_height), self.resample)
+        resized_image = self.resize_image(self.image, (new_width, new_height))
 
         # Calculate cropping box
         left = (new_width - tw) * self.offset[0]
@@ -158,7 +167,7 @@ class ImageResizer:
             new_height = th
 
         # Resize image while preserving aspect ratio
-        resized_image = self.image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        resized_image = self.resize_image(self.image, (new_width, new_height))
         resized_image = resized_image.convert("RGB")
 
         # Create a new canvas with the target dimensions and the specified color
@@ -180,9 +189,11 @@ class ImageResizer:
 
 
 class ColorModeConverter:
-    def __init__(self, image: Image.Image, color_mode: str):
+    def __init__(self, image: Image.Image, color_mode: str, palette: Optional[list[int]] = None):
         self.image = image
         self.color_mode = color_mode
+        self.palette = palette
+        # Flat RGB values of a palette shared by the whole run. Without it adaptive_palette quantizes every image
 
     def prevalidate(self):
         if not isinstance(self.image, Image.Image):
@@ -206,6 +217,12 @@ class ColorModeConverter:
             case 'cmyk': self.image = self.image.convert('CMYK')
             case 'lab': self.image = self.image.convert('LAB')
             case 'hsv': self.image = self.image.convert('HSV')
+            case 'web_palette': self.image = self.image.convert('RGB').convert('P', palette=Image.Palette.WEB)
+            case 'adaptive_palette':
+                if self.palette is not None:
+                    self.image = map_to_palette(self.image, self.palette)
+                else:
+                    self.image = quantize(self.image)
             case _: raise ValueError(f'Unknown color_mode {self.color_mode}')
 
         return self.image
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Palettes for the web_palette and adaptive_palette color modes.
+
+A shared palette is quantized once from a sample of the run. Every image is then only mapped to its
+nearest colors, which costs a fraction of a full quantization and keeps colors consistent across files.
+Palettes are cached on disk by a fingerprint of the operations and the sampled files, so reruns and
+other workers of the same job reuse them
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, features
+
+from logging_tools import get_logger
+from .loader import ImageLoader
+
+
+logger = get_logger()
+
+# Sample images are shrunk to fit this before their pixels go to the quantizer
+_SAMPLE_TILE = 256
+
+
+def get_quantize_method() -> Image.Quantize:
+    """libimagequant gives the best palettes when Pillow is built with it, fast octree otherwise"""
+    if features.check('libimagequant'):
+        return Image.Quantize.LIBIMAGEQUANT
+    return Image.Quantize.FASTOCTREE
+
+def quantize(image: Image.Image, colors: int = 256) -> Image.Image:
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image.quantize(colors, method=get_quantize_method())
+
+def map_to_palette(image: Image.Image, palette: list[int]) -> Image.Image:
+    """Nearest color mapping without dithering. Alpha is dropped, a fixed palette has no transparent entry"""
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette)
+    return image.convert('RGB').quantize(palette=palette_image, dither=Image.Dither.NONE)
+
+
+def get_cache_dir() -> Path:
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'mm-baldur' / 'palettes'
+
+def get_fingerprint(operations: dict, files: list[Path]) -> str:
+    """Changes when the operations or any sampled file (path, size, modification time) change"""
+    digest = hashlib.sha256(json.dumps(operations, sort_keys=True, default=str).encode('utf-8'))
+    for file in files:
+        stat = file.stat()
+        digest.update(f'{file}\0{stat.st_size}\0{stat.st_mtime_ns}\0'.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+def pick_sample(files: list[Path], sample_size: int) -> list[Path]:
+    """Evenly spaced over the sorted paths, so every node of a run picks the same files"""
+    ordered = sorted(files)
+    if len(ordered) <= sample_size:
+        return ordered
+    step = len(ordered) / sample_size
+    return [ordered[int(i * step)] for i in range(sample_size)]
+
+def build_palette(files: list[Path], colors: int = 256) -> list[int]:
+    """Quantizes thumbnails of the files together, returns the palette as flat RGB values"""
+    loader = ImageLoader()
+    tiles = []
+    for file in files:
+        try:
+            image = loader.load(file, (_SAMPLE_TILE, _SAMPLE_TILE))
+            image.thumbnail((_SAMPLE_TILE, _SAMPLE_TILE))
+            tiles.append(image.convert('RGB'))
+        except Exception as e:
+            logger.warning(f'Unable to sample {file} for the shared palette: {e}')
+        finally:
+            loader.release()
+
+    if not tiles:
+        raise ValueError('No readable images to build the shared palette from')
+
+    # One row of all sampled pixels: the quantizer only counts colors, and a row needs no padding
+    pixels = b''.join(tile.tobytes() for tile in tiles)
+    strip = Image.frombytes('RGB', (len(pixels) // 3, 1), pixels)
+
+    quantized = quantize(strip, colors)
+    return quantized.getpalette()[:colors * 3]
+
+def get_shared_palette(files: list[Path], operations: dict, sample_size: int = 32, colors: int = 256,
+                       cache_dir: Optional[Path] = None) -> list[int]:
+    sample = pick_sample(files, sample_size)
+    cache_dir = cache_dir or get_cache_dir()
+    cache_file = cache_dir / f'{get_fingerprint(operations, sample)}.json'
+
+    try:
+        palette = json.loads(cache_file.read_text(encoding='utf-8'))
+        logger.info(f'Shared palette loaded from {cache_file}')
+        return palette
+    except (OSError, ValueError):
+        pass
+
+    palette = build_palette(sample, colors)
+    logger.info(f'Shared palette of {len(palette) // 3} colors built from {len(sample)} images')
+
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(palette), encoding='utf-8')
+        tmp_path.replace(cache_file)
+    except OSError as e:
+        logger.warning(f'Unable to cache the shared palette in {cache_dir}: {e}')
+
+    return palette
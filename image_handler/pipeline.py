@@ -0,0 +1,169 @@
+"""
+Stage-split execution: decode, transform and encode run in separate process pools sized independently,
+so a slow encoder can get more cores than decoding.
+
+Pixels move between the stages through shared memory slabs instead of pickles. A slab is taken from a
+recycled pool when an image is decoded, the transform writes its result back into the same slab, and the
+slab returns to the pool once the image is encoded. Images that don't fit into a slab travel pickled.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from PIL import Image
+
+from logging_tools import get_logger
+from . import get_min_size
+from .loader import ImageLoader
+from .transformer import ImageTransformer
+from .saver import ImageSaver
+
+
+logger = get_logger()
+
+# Image.info keys the encoders read, they travel with the pixels so staged outputs match regular ones
+_KEPT_INFO = ('transparency', 'icc_profile', 'dpi', 'exif')
+
+
+class PixelMeta(NamedTuple):
+    """Describes the pixels in a slab, or carries them when they didn't fit"""
+    mode: str
+    size: tuple[int, int]
+    nbytes: int
+    palette: Optional[list]
+    info: dict
+    data: Optional[bytes]
+
+
+def _put_pixels(image: Image.Image, slab_name: str) -> PixelMeta:
+    palette = image.getpalette() if image.mode == 'P' else None
+    info = {key: image.info[key] for key in _KEPT_INFO if key in image.info}
+    data = image.tobytes()
+
+    shm = SharedMemory(name=slab_name)
+    try:
+        if len(data) > shm.size:
+            logger.debug(f'{image.mode} {image.size} image is larger than a slab, passing it pickled')
+            return PixelMeta(image.mode, image.size, len(data), palette, info, data)
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return PixelMeta(image.mode, image.size, len(data), palette, info, None)
+
+def _get_pixels(meta: PixelMeta, shm: Optional[SharedMemory]) -> Image.Image:
+    data = meta.data if meta.data is not None else shm.buf[:meta.nbytes]
+    # A copy, so nothing points into the slab once the stage is done with it
+    image = Image.frombytes(meta.mode, meta.size, data)
+    if isinstance(data, memoryview):
+        data.release()
+    if meta.palette is not None:
+        image.putpalette(meta.palette)
+    image.info.update(meta.info)
+    return image
+
+def _with_slab(meta: PixelMeta, slab_name: str):
+    return None if meta.data is not None else SharedMemory(name=slab_name)
+
+
+def _decode(source: Path, slab_name: str, min_size: Optional[tuple[int, int]]) -> PixelMeta:
+    loader = ImageLoader()
+    try:
+        return _put_pixels(loader.load(source, min_size), slab_name)
+    finally:
+        loader.release()
+
+def _transform(meta: PixelMeta, slab_name: str, operations: dict) -> PixelMeta:
+    shm = _with_slab(meta, slab_name)
+    try:
+        image = _get_pixels(meta, shm)
+    finally:
+        if shm is not None:
+            shm.close()
+    image = ImageTransformer().transform(image, operations)
+    return _put_pixels(image, slab_name)
+
+def _encode(meta: PixelMeta, slab_name: str, target_path: Path, encoder_params: Optional[dict]) -> None:
+    shm = _with_slab(meta, slab_name)
+    try:
+        image = _get_pixels(meta, shm)
+    finally:
+        if shm is not None:
+            shm.close()
+    ImageSaver().save(image, target_path, encoder_params)
+
+
+class SlabPool:
+    def __init__(self, count: int, slab_bytes: int) -> None:
+        self.slabs = [SharedMemory(create=True, size=slab_bytes) for _ in range(count)]
+        self.free = deque(shm.name for shm in self.slabs)
+
+    def close(self) -> None:
+        for shm in self.slabs:
+            shm.close()
+            shm.unlink()
+
+
+class StagedImagePipeline:
+    def __init__(self, decode_workers: int = 1, transform_workers: int = 1, encode_workers: int = 1,
+                 slab_mb: int = 64, slabs: Optional[int] = None) -> None:
+        # Enough slabs to keep every worker busy with one image queued behind it
+        slabs = slabs or 2 * (decode_workers + transform_workers + encode_workers)
+        self.pools = {
+            'decode': ProcessPoolExecutor(max_workers=decode_workers),
+            'transform': ProcessPoolExecutor(max_workers=transform_workers),
+            'encode': ProcessPoolExecutor(max_workers=encode_workers),
+        }
+        self.slab_pool = SlabPool(slabs, slab_mb * 1024 * 1024)
+
+    def close(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown(cancel_futures=True)
+        self.slab_pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def run(self, jobs: Iterable[tuple[Path, Path]], operations: dict) -> Iterator[tuple[Path, Path, Optional[Exception]]]:
+        """
+        Processes (source, target) pairs, yields (source, target, error) as images finish, error is None
+        on success. Decoding is admitted only while a slab is free, which bounds the memory in flight
+        """
+        encoder_params = operations.get('encoder')
+        min_size = get_min_size(operations)
+        queued = deque(jobs)
+        pending: dict[Future, tuple[str, Path, Path, str]] = {}
+        free = self.slab_pool.free
+
+        while queued or pending:
+            while queued and free:
+                source, target = queued.popleft()
+                slab = free.popleft()
+                future = self.pools['decode'].submit(_decode, source, slab, min_size)
+                pending[future] = ('decode', source, target, slab)
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, source, target, slab = pending.pop(future)
+                try:
+                    meta = future.result()
+                except Exception as e:
+                    free.append(slab)
+                    yield source, target, e
+                    continue
+
+                match stage:
+                    case 'decode':
+                        next_future = self.pools['transform'].submit(_transform, meta, slab, operations)
+                        pending[next_future] = ('transform', source, target, slab)
+                    case 'transform':
+                        next_future = self.pools['encode'].submit(_encode, meta, slab, target, encoder_params)
+                        pending[next_future] = ('encode', source, target, slab)
+                    case 'encode':
+                        free.append(slab)
+                        yield source, target, None
@@ -0,0 +1,184 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+# Modes that map to a uint8 array with one plane per band
+_ARRAY_MODES = ('L', 'RGB', 'RGBA')
+
+
+class ResizeBackend(ABC):
+    """Resizes an image to an exact size. Every backend takes the same Pillow resampling filters"""
+    name: str = ''
+
+    @abstractmethod
+    def resize(self, image: Image.Image, size: tuple[int, int], resample: int) -> Image.Image:
+        pass
+
+
+class PillowBackend(ResizeBackend):
+    """
+    Image.resize. reducing_gap lets Pillow box-reduce the image by an integer factor first,
+    which is much faster for big downscales and barely changes the result
+    """
+    name = 'pillow'
+
+    def __init__(self, reducing_gap: Optional[float] = None) -> None:
+        self.reducing_gap = reducing_gap
+
+    def resize(self, image: Image.Image, size: tuple[int, int], resample: int) -> Image.Image:
+        return image.resize(size, resample, reducing_gap=self.reducing_gap)
+
+
+class NumpyBackend(ResizeBackend):
+    """
+    Box reduction by averaging blocks of pixels, for downscales by an integer factor on both axes.
+    RGBA colors are weighted by alpha, like Pillow does, so transparent pixels don't bleed into the edges.
+    Other sizes and modes go to Pillow
+    """
+    name = 'numpy'
+
+    def __init__(self) -> None:
+        if np is None:
+            raise ValueError('resize_backend numpy needs numpy to be installed')
+
+    def resize(self, image: Image.Image, size: tuple[int, int], resample: int) -> Image.Image:
+        if not self.supports(image, size):
+            return image.resize(size, resample)
+
+        width, height = image.size
+        kx, ky = width // size[0], height // size[1]
+
+        array = np.asarray(image)
+        area = kx * ky
+
+        if image.mode == 'RGBA':
+            alpha = array[:, :, 3:]
+            alpha_sums = self._block_sums(alpha, size, kx, ky)
+            # 255 * 255 still fits in uint16
+            color_sums = self._block_sums(array[:, :, :3] * alpha.astype(np.uint16), size, kx, ky)
+            # Blocks with no opaque pixel keep black, the color of a fully transparent pixel doesn't matter
+            color = (color_sums + alpha_sums // 2) // np.maximum(alpha_sums, 1)
+            reduced = np.concatenate((color, (alpha_sums + area // 2) // area), axis=2)
+            return Image.fromarray(reduced.astype(np.uint8), image.mode)
+
+        reduced = (self._block_sums(array, size, kx, ky) + area // 2) // area
+
+        reduced = reduced.astype(np.uint8)
+        if array.ndim == 2:
+            reduced = reduced[:, :, 0]
+        return Image.fromarray(reduced, image.mode)
+
+    @staticmethod
+    def _block_sums(array, size: tuple[int, int], kx: int, ky: int):
+        """Sums of kx by ky blocks per band, as a (height, width, bands) array"""
+        width = array.shape[1]
+        bands = 1 if array.ndim == 2 else array.shape[2]
+        peak = int(np.iinfo(array.dtype).max)
+        # Rows first: adding whole rows is contiguous and several times faster than a 2D block sum.
+        # The narrowest type that holds the sums is used, e.g. uint16 for columns of 8-bit values up to ky 257
+        rows = array.reshape(size[1], ky, width, bands).sum(axis=1, dtype=_sum_dtype(ky * peak))
+        return rows.reshape(size[1], size[0], kx, bands).sum(axis=2, dtype=_sum_dtype(kx * ky * peak))
+
+    @staticmethod
+    def supports(image: Image.Image, size: tuple[int, int]) -> bool:
+        width, height = image.size
+        return (image.mode in _ARRAY_MODES
+                and size[0] <= width and size[1] <= height
+                and width % size[0] == 0 and height % size[1] == 0)
+
+
+def _sum_dtype(peak: int):
+    for dtype in (np.uint16, np.uint32):
+        if peak <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+class OpenCVBackend(ResizeBackend):
+    """
+    cv2.resize. Downscales use INTER_AREA whatever the filter is: the other OpenCV filters don't antialias,
+    INTER_AREA gives results close to Pillow's filters and is the fastest.
+    RGBA is resized with premultiplied alpha, like Pillow does
+    """
+    name = 'opencv'
+
+    def __init__(self) -> None:
+        if cv2 is None:
+            raise ValueError('resize_backend opencv needs opencv-python to be installed')
+
+        self.interpolation_map = {
+            Image.Resampling.NEAREST: cv2.INTER_NEAREST,
+            Image.Resampling.BILINEAR: cv2.INTER_LINEAR,
+            Image.Resampling.BICUBIC: cv2.INTER_CUBIC,
+            Image.Resampling.LANCZOS: cv2.INTER_LANCZOS4,
+            Image.Resampling.BOX: cv2.INTER_AREA,
+            Image.Resampling.HAMMING: cv2.INTER_LINEAR,
+        }
+
+    def resize(self, image: Image.Image, size: tuple[int, int], resample: int) -> Image.Image:
+        if image.mode not in _ARRAY_MODES:
+            return image.resize(size, resample)
+
+        width, height = image.size
+        if resample == Image.Resampling.NEAREST:
+            interpolation = cv2.INTER_NEAREST
+        elif size[0] <= width and size[1] <= height:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = self.interpolation_map[resample]
+
+        if image.mode == 'RGBA':
+            return Image.fromarray(self._resize_premultiplied(np.asarray(image), size, interpolation), image.mode)
+
+        resized = cv2.resize(np.asarray(image), size, interpolation=interpolation)
+        return Image.fromarray(resized, image.mode)
+
+    @staticmethod
+    def _resize_premultiplied(array, size: tuple[int, int], interpolation: int):
+        premultiplied = array.astype(np.float32)
+        alpha = premultiplied[:, :, 3:]
+        premultiplied[:, :, :3] *= alpha / 255
+
+        resized = cv2.resize(premultiplied, size, interpolation=interpolation)
+        alpha = resized[:, :, 3:]
+        resized[:, :, :3] *= 255 / np.maximum(alpha, 1e-3)
+        resized[:, :, :3] *= alpha > 0
+        return np.clip(resized + 0.5, 0, 255).astype(np.uint8)
+
+
+def get_resize_backend(name: Optional[str], source_size: tuple[int, int], target_size: tuple[int, int],
+                       resample: int, mode: Optional[str] = None) -> ResizeBackend:
+    """
+    Returns the backend by name. 'auto' picks by scale factor:
+    - upscales and downscales below 2x stay with exact Pillow resize
+    - so do the nearest and box filters, Pillow is the fastest with them
+    - other 2x and larger downscales use OpenCV if installed, Pillow with a reducing gap otherwise.
+      RGBA always goes to Pillow: it premultiplies alpha natively, OpenCV needs float copies for that
+    """
+    match name:
+        case None | 'pillow': return PillowBackend()
+        case 'numpy': return NumpyBackend()
+        case 'opencv': return OpenCVBackend()
+        case 'auto': pass
+        case _: raise ValueError(f'Unknown resize backend {name}')
+
+    scale = min(source_size[0] / target_size[0], source_size[1] / target_size[1])
+    if scale < 2 or resample in (Image.Resampling.NEAREST, Image.Resampling.BOX):
+        return PillowBackend()
+
+    if cv2 is not None and mode != 'RGBA':
+        return OpenCVBackend()
+
+    return PillowBackend(reducing_gap=3.0)
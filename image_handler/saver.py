@@ -1,5 +1,7 @@
+import io
 import logging
 from pathlib import Path
+from typing import Optional
 
 from PIL import Image
 
@@ -7,14 +9,32 @@ from base_classes import Saver
 
 
 class ImageSaver(Saver):
-    def save(self, image: Image.Image, target_path: Path) -> None:
+    def save(self, image: Image.Image, target_path: Path, encoder_params: Optional[dict] = None) -> None:
         self.item = image
         self.target_path = target_path
 
-        self.item.save(self.target_path)
+        image_format = get_image_format(self.target_path.suffix[1:])
+        self.save_as(image, target_path, image_format, get_save_params(image_format, encoder_params))
+
+    def save_as(self, image: Image.Image, target_path: Path, image_format: str, save_params: dict) -> None:
+        """save with the format and its arguments already resolved"""
+        self.item = image
+        self.target_path = target_path
+
+        self.item.save(self.target_path, format=image_format, **save_params)
 
         logging.debug(f"Image saved to {self.target_path}")
 
+    def save_bytes(self, image: Image.Image, image_format: str, encoder_params: Optional[dict] = None) -> bytes:
+        """Encodes the image in the Pillow format image_format (see get_image_format) and returns the bytes"""
+        self.item = image
+
+        buffer = io.BytesIO()
+        self.item.save(buffer, format=image_format, **get_save_params(image_format, encoder_params))
+
+        logging.debug(f"Image encoded to {image_format}, {buffer.tell()} bytes")
+        return buffer.getvalue()
+
     @property
     def item(self):
         return self._item
@@ -24,3 +44,55 @@ class ImageSaver(Saver):
         if not isinstance(new, Image.Image):
             raise TypeError("IE: image must be an instance of PIL.Image.Image")
         self._item = new
+
+
+class SaveFormats:
+    """Cache of (format, save arguments) by target extension, for batches that save many files"""
+
+    def __init__(self, encoder_params: Optional[dict]) -> None:
+        self.encoder_params = encoder_params
+        self._formats: dict[str, tuple[str, dict]] = {}
+
+    def get(self, target_path: Path) -> tuple[str, dict]:
+        ext = target_path.suffix[1:].lower()
+        if ext not in self._formats:
+            image_format = get_image_format(ext)
+            self._formats[ext] = image_format, get_save_params(image_format, self.encoder_params)
+        return self._formats[ext]
+
+
+def get_image_format(output_ext: str) -> str:
+    """Maps a file extension to the Pillow format name, the same way Image.save does for paths"""
+    image_format = Image.registered_extensions().get(f'.{output_ext.lower()}')
+    if image_format is None:
+        raise ValueError(f'Unknown image extension {output_ext}')
+    return image_format
+
+
+def get_save_params(image_format: str, encoder_params: Optional[dict]) -> dict:
+    """
+    Translates the encoder section of the config into Image.save arguments of the format.
+    Knobs the format doesn't have are left out
+    """
+    if not encoder_params:
+        return {}
+
+    quality = encoder_params.get('quality')
+    lossless = encoder_params.get('lossless')
+
+    params = {}
+    match image_format:
+        case 'JPEG':
+            if quality is not None: params['quality'] = quality
+        case 'WEBP':
+            if quality is not None: params['quality'] = quality
+            if lossless is not None: params['lossless'] = lossless
+            if encoder_params.get('method') is not None: params['method'] = encoder_params['method']
+        case 'AVIF':
+            if quality is not None: params['quality'] = quality
+            if encoder_params.get('speed') is not None: params['speed'] = encoder_params['speed']
+            if lossless:
+                # AVIF has no lossless switch, full quality without chroma subsampling is the closest
+                params['quality'] = 100
+                params['subsampling'] = '4:4:4'
+    return params
@@ -1,4 +1,5 @@
-from PIL import Image
+from functools import partial
+from typing import Callable
 import logging
 
 from PIL import Image, ImageEnhance
@@ -7,34 +8,61 @@ from base_classes import Transformer
 from .operations import ImageResizer, ColorModeConverter
 
 
+_ENHANCERS = {
+    'color_balance': ImageEnhance.Color,
+    'contrast': ImageEnhance.Contrast,
+    'brightness': ImageEnhance.Brightness,
+    'sharpness': ImageEnhance.Sharpness,
+}
+
+
+def _rotate(image: Image.Image, angle) -> Image.Image:
+    return image.rotate(angle)
+
+def _resize(image: Image.Image, params: dict) -> Image.Image:
+    return ImageResizer(image, params).run()
+
+def _convert_color_mode(image: Image.Image, color_mode: str, palette) -> Image.Image:
+    return ColorModeConverter(image, color_mode, palette).run()
+
+def _enhance(image: Image.Image, enhancer, factor: float) -> Image.Image:
+    return enhancer(image).enhance(factor)
+
+
 class ImageTransformer(Transformer):
     def transform(self, image: Image.Image, instructions: dict) -> Image.Image:
-        self.item = image
+        return self.apply(image, self.compile(instructions))
+
+    def compile(self, instructions: dict) -> list[Callable[[Image.Image], Image.Image]]:
+        """
+        Turns instructions into a plan: a list of steps, each takes an image and returns the transformed one.
+        Unknown operations fail here, so a plan can be built once and applied to many images
+        """
         self.instructions = instructions
 
+        plan = []
         for operation, parameters in self.instructions.items():
             match operation:
-                case 'rotate': self.item = self.item.rotate(parameters)
-                case 'resize': self.item = ImageResizer(self.item, parameters).run()
-                case 'color_mode': self.item = ColorModeConverter(self.item, parameters).run()
-                case 'color_balance':
-                    if isinstance(parameters, float):
-                        enh = ImageEnhance.Color(self.item)
-                        self.item = enh.enhance(parameters)
-                case 'contrast':
-                    if isinstance(parameters, float):
-                        enh = ImageEnhance.Contrast(self.item)
-                        self.item = enh.enhance(parameters)
-                case 'brightness':
-                    if isinstance(parameters, float):
-                        enh = ImageEnhance.Brightness(self.item)
-                        self.item = enh.enhance(parameters)
-                case 'sharpness':
+                case 'rotate': plan.append(partial(_rotate, angle=parameters))
+                case 'resize': plan.append(partial(_resize, params=parameters))
+                case 'color_mode':
+                    plan.append(partial(_convert_color_mode, color_mode=parameters, palette=instructions.get('palette')))
+                case 'color_balance' | 'contrast' | 'brightness' | 'sharpness':
                     if isinstance(parameters, float):
-                        enh = ImageEnhance.Sharpness(self.item)
-                        self.item = enh.enhance(parameters)
+                        plan.append(partial(_enhance, enhancer=_ENHANCERS[operation], factor=parameters))
+                case 'encoder': pass  # Encoder settings are applied by the saver
+                case 'icon_frames': pass  # Frames are picked by the loader
+                case 'shared_palette' | 'palette': pass  # Built by the file manager, used by color_mode
                 case _: raise ValueError(f"Unsupported operation {operation}")
 
+        return plan
+
+    def apply(self, image: Image.Image, plan: list[Callable[[Image.Image], Image.Image]]) -> Image.Image:
+        self.item = image
+
+        for step in plan:
+            self.item = step(self.item)
+
         return self.item
 
     @property
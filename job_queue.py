@@ -0,0 +1,183 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable
+
+from logging_tools import get_logger
+
+
+logger = get_logger()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+
+class JobQueue:
+    """
+    Durable job queue in a SQLite file. Jobs are file paths relative to input_dir_path,
+    so hosts may mount the shared storage under different paths.
+
+    Workers claim jobs with a lease. A job whose lease expired (its worker crashed or hung) is handed out again,
+    until it has been attempted max_attempts times.
+
+    WAL mode needs shared memory between processes, so it works only when all workers run on one host.
+    For workers on different hosts use journal_mode 'delete', which relies on the file locks of the shared storage.
+    """
+
+    def __init__(self, db_path: Path, lease_seconds: float = 300.0, max_attempts: int = 3,
+                 journal_mode: str = 'wal') -> None:
+        if lease_seconds <= 0:
+            raise ValueError('lease_seconds must be positive')
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(db_path, timeout=60.0, isolation_level=None)
+        self._conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, paths: Iterable[str]) -> int:
+        """Adds jobs, paths that are already queued are ignored. Returns the number of new jobs"""
+        with self._transaction():
+            before = self._conn.total_changes
+            self._conn.executemany('INSERT OR IGNORE INTO jobs (path) VALUES (?)', ((p,) for p in paths))
+            return self._conn.total_changes - before
+
+    def claim(self, worker_id: str, limit: int) -> list[tuple[int, str]]:
+        """Leases up to limit jobs to the worker. Returns (job_id, path) pairs"""
+        now = time.time()
+        with self._transaction():
+            # Jobs whose last attempt expired and have no attempts left won't be retried
+            self._conn.execute(
+                "UPDATE jobs SET state = 'failed', lease_owner = NULL, finished_at = ?, "
+                "error = 'Lease expired on the last attempt' "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+
+            jobs = self._conn.execute(
+                "SELECT id, path FROM jobs "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                "ORDER BY id LIMIT ?",
+                (now, limit)).fetchall()
+
+            self._conn.executemany(
+                "UPDATE jobs SET state = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                ((worker_id, now + self.lease_seconds, job_id) for job_id, _ in jobs))
+
+        return jobs
+
+    def extend(self, job_ids: list[int], worker_id: str) -> None:
+        """Renews the leases of jobs the worker still holds"""
+        expires = time.time() + self.lease_seconds
+        with self._transaction():
+            self._conn.executemany(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                ((expires, job_id, worker_id) for job_id in job_ids))
+
+    def complete(self, job_id: int, worker_id: str) -> None:
+        self._finish(job_id, worker_id, 'done', None)
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> None:
+        """Returns the job to the queue, or marks it failed when it has no attempts left"""
+        with self._transaction():
+            attempts = self._conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+            if attempts < self.max_attempts:
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'pending', lease_owner = NULL, lease_expires = NULL, error = ? "
+                    "WHERE id = ? AND lease_owner = ?",
+                    (error, job_id, worker_id))
+                return
+        self._finish(job_id, worker_id, 'failed', error)
+
+    def stats(self, window_seconds: float = 60.0) -> dict:
+        """
+        Returns queue counters and live throughput:
+        - pending, leased, done, failed: number of jobs in each state
+        - backlog: jobs that are not finished yet
+        - workers: workers holding an active lease
+        - jobs_per_second: jobs finished during the last window_seconds
+        - eta_seconds: backlog / jobs_per_second, None if nothing was finished recently
+        """
+        now = time.time()
+        counts = dict(self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        finished = self._conn.execute(
+            'SELECT COUNT(*) FROM jobs WHERE finished_at >= ?', (now - window_seconds,)).fetchone()[0]
+        workers = self._conn.execute(
+            "SELECT COUNT(DISTINCT lease_owner) FROM jobs WHERE state = 'leased' AND lease_expires >= ?",
+            (now,)).fetchone()[0]
+
+        stats = {state: counts.get(state, 0) for state in ('pending', 'leased', 'done', 'failed')}
+        stats['backlog'] = stats['pending'] + stats['leased']
+        stats['workers'] = workers
+        stats['jobs_per_second'] = finished / window_seconds
+        stats['eta_seconds'] = stats['backlog'] / stats['jobs_per_second'] if finished else None
+        return stats
+
+    def failures(self) -> list[dict]:
+        rows = self._conn.execute("SELECT path, error FROM jobs WHERE state = 'failed' ORDER BY id").fetchall()
+        return [{'file': path, 'error': error} for path, error in rows]
+
+    def _finish(self, job_id: int, worker_id: str, state: str, error) -> None:
+        with self._transaction():
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, error = ?, finished_at = ? "
+                "WHERE id = ? AND lease_owner = ?",
+                (state, error, time.time(), job_id, worker_id))
+        if cursor.rowcount == 0:
+            # The lease expired and the job was handed to another worker, its result wins
+            logger.debug(f'Lease on job {job_id} was lost by {worker_id}')
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE takes the write lock up front, so concurrent claims can't hand out the same job"""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+        return self._conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._conn.execute('COMMIT')
+        else:
+            self._conn.execute('ROLLBACK')
+        return False
+
+
+def format_stats(stats: dict) -> str:
+    eta = 'unknown' if stats['eta_seconds'] is None else f"{stats['eta_seconds']:.0f}s"
+    return (f"backlog {stats['backlog']} ({stats['pending']} pending, {stats['leased']} leased), "
+            f"{stats['done']} done, {stats['failed']} failed, {stats['workers']} workers, "
+            f"{stats['jobs_per_second']:.2f} files/s, ETA {eta}")
@@ -1,5 +1,9 @@
+import os
+import socket
+from contextlib import contextmanager
 import sys
 import logging
+from pathlib import Path
 
 import click
 from deepmerge import always_merger
@@ -9,25 +13,17 @@ from logging_tools import get_logger, setup_logger
 from yaml_tools import load_config, ConfigError
 from config_validation import validate_cli_params, validate_structure_and_base_config, validate_ops_config
 from tools import split_config, prepare_base_config, prepare_ops_config
+from report_tools import write_summary, load_summary, merge_summaries, log_report
 from file_manager import FileManager
+from job_queue import JobQueue, format_stats
+from server import run_server
+from estimator import RunEstimator, log_estimate
+from sampler import SampleRun, log_sample_report
+from metrics import MetricsExporter, get_metrics
 
 
-@click.command()
-@click.option('--log-level', '-l',
-              default=CONST.default_log_level,
-              help='Logging level (debug, info, warning, error)')
-@click.option('--config-file', '-c',
-              default=CONST.default_config_file,
-              help='Specify path to config file')
-def run(log_level: str, config_file: str) -> None:
-    cli_params = {
-        'log_level': log_level,
-        'config_file': config_file,
-    }
-
-    validate_cli_params(cli_params)
-
-    setup_logger(level=log_level)
+def load_configs(config_file: str) -> tuple[dict, dict]:
+    """Loads, validates and prepares the user config. Exits on any error"""
     logger = get_logger()
 
     # Load user config
@@ -58,14 +54,288 @@ def run(log_level: str, config_file: str) -> None:
         logger.error(f'IE: {e}', exc_info=True)
         sys.exit(1)
 
+    return base_config, ops_config or {}
+
+
+@click.group(invoke_without_command=True)
+@click.option('--log-level', '-l',
+              default=CONST.default_log_level,
+              help='Logging level (debug, info, warning, error)')
+@click.option('--config-file', '-c',
+              default=CONST.default_config_file,
+              help='Specify path to config file')
+@click.option('--shard-index',
+              default=0, type=int,
+              help='Index of the shard processed by this node (0-based)')
+@click.option('--shard-count',
+              default=1, type=int,
+              help='Total number of shards the input is split into')
+@click.option('--summary-file',
+              default=None,
+              help='Write a JSON summary of the run to this path')
+@click.option('--estimate',
+              is_flag=True,
+              help='Only estimate time, memory and output size of the run, nothing is written')
+@click.option('--estimate-samples',
+              default=16, type=int,
+              help='Number of images processed to calibrate the estimate')
+@click.option('--sample',
+              default=None,
+              help='Process only a sample of the input, N files or P% of them, and report timings and sizes')
+@click.option('--sample-seed',
+              default=0, type=int,
+              help='Seed of the sample, the same seed picks the same files')
+@click.option('--sample-stratify',
+              multiple=True, type=click.Choice(['ext', 'dir']),
+              help='Sample every extension / subdirectory proportionally, can be given twice')
+@click.option('--metrics-file',
+              default=None,
+              help='Periodically write Prometheus metrics to this file (node_exporter textfile collector)')
+@click.option('--metrics-port',
+              default=None, type=int,
+              help='Serve Prometheus metrics on http://127.0.0.1:<port>/metrics')
+@click.option('--metrics-interval',
+              default=15.0, type=float,
+              help='Seconds between metrics file updates')
+@click.pass_context
+def cli(ctx: click.Context, log_level: str, config_file: str,
+        shard_index: int, shard_count: int, summary_file: str, estimate: bool, estimate_samples: int,
+        sample: str, sample_seed: int, sample_stratify: tuple[str, ...],
+        metrics_file: str, metrics_port: int, metrics_interval: float) -> None:
+    ctx.obj = {
+        'log_level': log_level,
+        'config_file': config_file,
+        'metrics_file': metrics_file,
+        'metrics_port': metrics_port,
+        'metrics_interval': metrics_interval,
+    }
+
+    if ctx.invoked_subcommand is None:
+        with start_metrics(metrics_file, metrics_port, metrics_interval):
+            run(log_level, config_file, shard_index, shard_count, summary_file, estimate, estimate_samples,
+                sample, sample_seed, sample_stratify)
+
+
+@contextmanager
+def start_metrics(metrics_file: str, metrics_port: int, metrics_interval: float):
+    """Runs the metrics exporter for the duration of the block, if a metrics file or port is given"""
+    if not metrics_file and not metrics_port:
+        yield None
+        return
+
+    exporter = MetricsExporter(get_metrics(), Path(metrics_file) if metrics_file else None,
+                               metrics_port, metrics_interval)
+    exporter.start()
+    try:
+        yield exporter
+    finally:
+        exporter.stop()
+
+
+def run(log_level: str, config_file: str, shard_index: int, shard_count: int, summary_file: str,
+        estimate: bool = False, estimate_samples: int = 16,
+        sample: str = None, sample_seed: int = 0, sample_stratify: tuple[str, ...] = ()) -> None:
+    cli_params = {
+        'log_level': log_level,
+        'config_file': config_file,
+        'shard_index': shard_index,
+        'shard_count': shard_count,
+        'summary_file': summary_file,
+        'estimate_samples': estimate_samples,
+        'sample': sample,
+        'sample_seed': sample_seed,
+    }
+
+    validate_cli_params(cli_params)
+    if shard_index >= shard_count:
+        print(f'Invalid CLI parameters: shard index {shard_index} must be less than shard count {shard_count}')
+        sys.exit(1)
+
+    setup_logger(level=log_level)
+    logger = get_logger()
+
+    base_config, ops_config = load_configs(config_file)
+
+    if estimate:
+        try:
+            file_manager = FileManager(base_config, ops_config, shard_index, shard_count)
+            log_estimate(RunEstimator(file_manager, estimate_samples).run())
+        except Exception as e:
+            logger.error(f'Error estimating the run: {e}', exc_info=True)
+            sys.exit(1)
+        return
+
+    if sample:
+        try:
+            file_manager = FileManager(base_config, ops_config, shard_index, shard_count)
+            log_sample_report(SampleRun(file_manager, sample, sample_seed, sample_stratify).run())
+        except Exception as e:
+            logger.error(f'Error processing the sample: {e}', exc_info=True)
+            sys.exit(1)
+        return
+
     # Process files
+    file_manager = None
     try:
-        file_manager = FileManager(base_config, ops_config)
+        file_manager = FileManager(base_config, ops_config, shard_index, shard_count)
         file_manager.run()
     except Exception as e:
         logger.error(f'{e}', exc_info=True)
         sys.exit(1)
+    finally:
+        if summary_file and file_manager is not None:
+            write_summary(file_manager.get_summary(), Path(summary_file))
+
+
+@cli.command()
+@click.argument('summary_files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o',
+              default=None,
+              help='Write the merged report as JSON to this path')
+@click.pass_obj
+def merge(obj: dict, summary_files: tuple[str, ...], output: str) -> None:
+    """Combines per-shard summaries into one report with totals and failures"""
+    validate_cli_params({'log_level': obj['log_level']})
+
+    setup_logger(level=obj['log_level'])
+    logger = get_logger()
+
+    try:
+        report = merge_summaries([load_summary(Path(f)) for f in summary_files])
+    except Exception as e:
+        logger.error(f'Error merging summaries: {e}', exc_info=True)
+        sys.exit(1)
+
+    log_report(report)
+
+    if output:
+        write_summary(report, Path(output))
+
+    if report['files_failed'] or report['missing_shards']:
+        sys.exit(1)
+
+
+def queue_options(func):
+    """Options shared by the job queue commands"""
+    func = click.option('--journal-mode',
+                        default='wal', type=click.Choice(['wal', 'delete']),
+                        help='SQLite journal mode. WAL works only when all workers run on one host')(func)
+    func = click.option('--max-attempts',
+                        default=3, type=int,
+                        help='How many times a job is tried before it is marked failed')(func)
+    func = click.option('--lease-seconds',
+                        default=300.0, type=float,
+                        help='Time a worker may hold a job before it is handed to another worker')(func)
+    func = click.option('--queue-file', '-q',
+                        required=True,
+                        help='Path to the SQLite job queue on storage shared by the workers')(func)
+    return func
+
+
+def open_queue(queue_file: str, lease_seconds: float, max_attempts: int, journal_mode: str) -> JobQueue:
+    try:
+        return JobQueue(Path(queue_file), lease_seconds, max_attempts, journal_mode)
+    except Exception as e:
+        get_logger().error(f'Error opening job queue {queue_file}: {e}', exc_info=True)
+        sys.exit(1)
+
+
+@cli.command()
+@queue_options
+@click.pass_obj
+def enqueue(obj: dict, queue_file: str, lease_seconds: float, max_attempts: int, journal_mode: str) -> None:
+    """Coordinator: puts input files of the config into the job queue"""
+    validate_cli_params({'log_level': obj['log_level'], 'config_file': obj['config_file']})
+
+    setup_logger(level=obj['log_level'])
+    logger = get_logger()
+
+    base_config, ops_config = load_configs(obj['config_file'])
+
+    with open_queue(queue_file, lease_seconds, max_attempts, journal_mode) as job_queue:
+        try:
+            FileManager(base_config, ops_config).enqueue(job_queue)
+        except Exception as e:
+            logger.error(f'{e}', exc_info=True)
+            sys.exit(1)
+        logger.info(f'Queue: {format_stats(job_queue.stats())}')
+
+
+@cli.command()
+@queue_options
+@click.option('--batch-size',
+              default=16, type=int,
+              help='Number of jobs claimed at once')
+@click.option('--report-interval',
+              default=30.0, type=float,
+              help='Seconds between queue progress reports')
+@click.pass_obj
+def worker(obj: dict, queue_file: str, lease_seconds: float, max_attempts: int, journal_mode: str,
+           batch_size: int, report_interval: float) -> None:
+    """Processes jobs from the queue until it is drained"""
+    validate_cli_params({'log_level': obj['log_level'], 'config_file': obj['config_file']})
+
+    setup_logger(level=obj['log_level'])
+    logger = get_logger()
+
+    base_config, ops_config = load_configs(obj['config_file'])
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+    with open_queue(queue_file, lease_seconds, max_attempts, journal_mode) as job_queue, \
+            start_metrics(obj['metrics_file'], obj['metrics_port'], obj['metrics_interval']):
+        try:
+            file_manager = FileManager(base_config, ops_config)
+            file_manager.run_worker(job_queue, worker_id, batch_size, report_interval=report_interval)
+        except Exception as e:
+            logger.error(f'{e}', exc_info=True)
+            sys.exit(1)
+        logger.info(f'Queue: {format_stats(job_queue.stats())}')
+
+
+@cli.command()
+@queue_options
+@click.pass_obj
+def status(obj: dict, queue_file: str, lease_seconds: float, max_attempts: int, journal_mode: str) -> None:
+    """Reports backlog and throughput of the job queue"""
+    validate_cli_params({'log_level': obj['log_level']})
+
+    setup_logger(level=obj['log_level'])
+    logger = get_logger()
+
+    with open_queue(queue_file, lease_seconds, max_attempts, journal_mode) as job_queue:
+        logger.info(f'Queue: {format_stats(job_queue.stats())}')
+        for failure in job_queue.failures():
+            logger.error(f"Failed: {failure['file']}: {failure['error']}")
+
+
+@cli.command()
+@click.option('--host',
+              default='127.0.0.1',
+              help='Address to listen on')
+@click.option('--port', '-p',
+              default=8080, type=int,
+              help='Port to listen on')
+@click.option('--workers', '-w',
+              default=None, type=int,
+              help='Number of worker processes, defaults to the number of CPUs')
+@click.option('--max-pending',
+              default=64, type=int,
+              help='Distinct requests in progress before new ones are rejected with 503')
+@click.option('--cache-mb',
+              default=64, type=int,
+              help='Size of the in-memory response cache in MB')
+@click.option('--max-body-mb',
+              default=64, type=int,
+              help='Largest accepted image in MB')
+@click.pass_obj
+def serve(obj: dict, host: str, port: int, workers: int, max_pending: int, cache_mb: int, max_body_mb: int) -> None:
+    """Runs a local HTTP server that processes images sent to POST /process"""
+    validate_cli_params({'log_level': obj['log_level']})
+
+    setup_logger(level=obj['log_level'])
+
+    run_server(host, port, workers, max_pending, cache_mb * 1024 * 1024, max_body_mb * 1024 * 1024)
 
 
 if __name__ == '__main__':
-    run()
+    cli()
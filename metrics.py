@@ -0,0 +1,251 @@
+"""
+Run metrics in the Prometheus text format, for node_exporter's textfile collector or a local scrape endpoint.
+Metrics are collected only after the registry is enabled, so runs without an exporter pay nothing for them.
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+
+from logging_tools import get_logger
+
+
+logger = get_logger()
+
+_STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_HELP = {
+    'mm_files_total': ('counter', 'Files handled, by result'),
+    'mm_input_bytes_total': ('counter', 'Bytes of input files handled'),
+    'mm_output_bytes_total': ('counter', 'Bytes of output files written'),
+    'mm_errors_total': ('counter', 'Errors by stage and exception type'),
+    'mm_stage_seconds': ('histogram', 'Time spent in a processing stage per file'),
+    'mm_files_per_second': ('gauge', 'Files handled per second over the last export interval'),
+    'mm_input_megabytes_per_second': ('gauge', 'Input MB per second over the last export interval'),
+    'mm_output_megabytes_per_second': ('gauge', 'Output MB per second over the last export interval'),
+    'mm_queue_depth': ('gauge', 'Jobs waiting to be processed'),
+    'mm_process_resident_memory_bytes': ('gauge', 'Resident memory of the process'),
+}
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def get_rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Not Linux: fall back to the peak, the closest number the resource module has
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._gauges: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], list] = {}  # bucket counts + [sum, count]
+        self._collectors: list[Callable[['MetricsRegistry'], None]] = []
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0] * len(_STAGE_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(_STAGE_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def time(self, name: str, **labels) -> '_Timer':
+        """Context manager that observes the duration of its block"""
+        return _Timer(self, name, labels)
+
+    def add_collector(self, collector: Callable[['MetricsRegistry'], None]) -> None:
+        """Registers a callback that updates gauges right before every export"""
+        self._collectors.append(collector)
+
+    def get_counter_total(self, name: str) -> float:
+        with self._lock:
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def get_histogram_totals(self, name: str, label: str) -> dict[str, tuple[float, int]]:
+        """Sum and count of a histogram per value of one label"""
+        totals = {}
+        with self._lock:
+            for (n, labels), histogram in self._histograms.items():
+                if n != name:
+                    continue
+                key = dict(labels).get(label)
+                seconds, count = totals.get(key, (0.0, 0))
+                totals[key] = (seconds + histogram[-2], count + histogram[-1])
+        return totals
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector(self)
+
+        with self._lock:
+            samples: dict[str, list[str]] = {}
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for (name, labels), value in self._gauges.items():
+                samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for (name, labels), histogram in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, count in zip(_STAGE_BUCKETS, histogram):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", f"{bound:g}"),))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram[-1]}')
+
+        text = []
+        for name in sorted(samples):
+            metric_type, help_text = _HELP.get(name, ('untyped', ''))
+            text.append(f'# HELP {name} {help_text}')
+            text.append(f'# TYPE {name} {metric_type}')
+            text.extend(samples[name])
+        return '\n'.join(text) + '\n'
+
+
+class _Timer:
+    def __init__(self, registry: MetricsRegistry, name: str, labels: dict) -> None:
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsExporter:
+    """
+    Exports the registry every interval seconds to a textfile (written atomically, as the textfile collector
+    requires) and/or serves it at http://127.0.0.1:<port>/metrics
+    """
+
+    def __init__(self, registry: MetricsRegistry, textfile: Optional[Path] = None, port: Optional[int] = None,
+                 interval: float = 15.0) -> None:
+        if textfile is None and port is None:
+            raise ValueError('MetricsExporter needs a textfile or a port')
+        self.registry = registry
+        self.textfile = textfile
+        self.port = port
+        self.interval = interval
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._http_server: Optional[ThreadingHTTPServer] = None
+        self._last = (time.monotonic(), 0.0, 0.0, 0.0)
+
+    def start(self) -> None:
+        self.registry.enabled = True
+        self.registry.add_collector(self._collect_rates)
+        self.registry.add_collector(lambda r: r.set('mm_process_resident_memory_bytes', get_rss_bytes()))
+
+        if self.port is not None:
+            self._http_server = ThreadingHTTPServer(('127.0.0.1', self.port), _make_handler(self.registry))
+            threading.Thread(target=self._http_server.serve_forever, name='metrics-http', daemon=True).start()
+            logger.info(f'Serving metrics on http://127.0.0.1:{self.port}/metrics')
+
+        if self.textfile is not None:
+            self._thread = threading.Thread(target=self._write_loop, name='metrics-textfile', daemon=True)
+            self._thread.start()
+            logger.info(f'Writing metrics to {self.textfile} every {self.interval:g}s')
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._http_server is not None:
+            self._http_server.shutdown()
+        if self.textfile is not None:
+            self._write()  # Final values of the run
+
+    def _write_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self._write()
+            except OSError as e:
+                logger.warning(f'Failed to write metrics to {self.textfile}: {e}')
+
+    def _write(self) -> None:
+        tmp_path = self.textfile.with_name(f'{self.textfile.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(self.registry.render(), encoding='utf-8')
+        tmp_path.replace(self.textfile)
+
+    def _collect_rates(self, registry: MetricsRegistry) -> None:
+        now = time.monotonic()
+        files = registry.get_counter_total('mm_files_total')
+        input_bytes = registry.get_counter_total('mm_input_bytes_total')
+        output_bytes = registry.get_counter_total('mm_output_bytes_total')
+
+        last_time, last_files, last_input, last_output = self._last
+        elapsed = now - last_time
+        if elapsed < 1.0:
+            return  # Scraped again right away, keep the previous rates
+
+        mb = 1024 * 1024
+        registry.set('mm_files_per_second', (files - last_files) / elapsed)
+        registry.set('mm_input_megabytes_per_second', (input_bytes - last_input) / elapsed / mb)
+        registry.set('mm_output_megabytes_per_second', (output_bytes - last_output) / elapsed / mb)
+        self._last = (now, files, input_bytes, output_bytes)
+
+
+def _make_handler(registry: MetricsRegistry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the run log
+
+    return MetricsHandler
+
+
+_registry = MetricsRegistry()
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
@@ -0,0 +1,67 @@
+import json
+from pathlib import Path
+
+from logging_tools import get_logger
+
+
+logger = get_logger()
+
+_COUNTERS = ('total_files', 'files_processed', 'files_skipped', 'files_copied', 'files_failed')
+
+
+def write_summary(summary: dict, summary_path: Path) -> None:
+    """Writes a run summary as JSON. Goes through a temp file, so a half-written summary is never merged"""
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = summary_path.with_name(f'{summary_path.name}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    tmp_path.replace(summary_path)
+    logger.info(f'Summary saved to {summary_path}')
+
+
+def load_summary(summary_path: Path) -> dict:
+    with open(summary_path, 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    missing = [k for k in _COUNTERS if k not in summary]
+    if missing:
+        raise ValueError(f'{summary_path} is not a run summary, missing keys: {missing}')
+    return summary
+
+
+def merge_summaries(summaries: list[dict]) -> dict:
+    """
+    Combines per-shard summaries into one report:
+    - counters are summed
+    - failures are concatenated
+    - shards that have no summary are listed in 'missing_shards'
+    """
+    report = {k: sum(s[k] for s in summaries) for k in _COUNTERS}
+    report['elapsed_seconds'] = max((s.get('elapsed_seconds', 0.0) for s in summaries), default=0.0)
+    report['failures'] = [failure for s in summaries for failure in s.get('failures', [])]
+
+    shard_counts = {s.get('shard_count', 1) for s in summaries}
+    if len(shard_counts) > 1:
+        raise ValueError(f'Summaries belong to runs with different shard counts: {sorted(shard_counts)}')
+
+    shard_count = shard_counts.pop() if shard_counts else 0
+    seen = [s.get('shard_index', 0) for s in summaries]
+    duplicates = sorted({i for i in seen if seen.count(i) > 1})
+    if duplicates:
+        raise ValueError(f'Duplicate summaries for shards {duplicates}')
+
+    report['shard_count'] = shard_count
+    report['shards_merged'] = sorted(seen)
+    report['missing_shards'] = [i for i in range(shard_count) if i not in seen]
+    return report
+
+
+def log_report(report: dict) -> None:
+    logger.info(f"{report['files_processed']}/{report['total_files']} files processed "
+                f"({report['files_skipped']} skipped, {report['files_copied']} copied, "
+                f"{report['files_failed']} failed) in {report['elapsed_seconds']:.1f}s")
+
+    if report.get('missing_shards'):
+        logger.warning(f"Missing summaries for shards {report['missing_shards']} of {report['shard_count']}")
+
+    for failure in report['failures']:
+        logger.error(f"Failed: {failure['file']}: {failure['error']}")
@@ -0,0 +1,145 @@
+import hashlib
+from pathlib import Path
+from typing import Iterable
+
+from archive_tools import is_archive
+from base_classes import JobResult
+from file_manager import FileManager
+from logging_tools import get_logger
+
+
+logger = get_logger()
+
+def parse_sample_spec(spec: str, total: int) -> int:
+    """'N' is a file count, 'P%' a share of all files. At least one file is picked from a non-empty input"""
+    if spec.endswith('%'):
+        count = round(total * float(spec[:-1]) / 100)
+    else:
+        count = int(spec)
+    return min(max(count, 1), total)
+
+def _rank(relative_path: Path, seed: int) -> bytes:
+    # Stable across runs and platforms, and a file keeps its rank when others are added to the corpus
+    return hashlib.blake2b(f'{seed}:{relative_path.as_posix()}'.encode('utf-8'), digest_size=8).digest()
+
+def _stratum(relative_path: Path, stratify: Iterable[str]) -> tuple:
+    key = []
+    for field in stratify:
+        match field:
+            case 'ext': key.append(relative_path.suffix.lower())
+            case 'dir': key.append(relative_path.parent.as_posix())
+            case _: raise ValueError(f'Unknown stratification {field}')
+    return tuple(key)
+
+def pick_sample(files: list[Path], input_dir: Path, count: int, seed: int = 0,
+                stratify: Iterable[str] = ()) -> list[Path]:
+    """
+    Deterministically picks count files: the ones with the lowest hash of seed and relative path.
+    With stratify ('ext', 'dir') files are grouped and every group gets its proportional share,
+    and at least one file as long as count allows, so rare formats and small directories are covered
+    """
+    strata: dict[tuple, list[tuple[bytes, Path]]] = {}
+    for file in files:
+        relative_path = file.relative_to(input_dir)
+        strata.setdefault(_stratum(relative_path, stratify), []).append((_rank(relative_path, seed), file))
+
+    base = 1 if count >= len(strata) else 0
+    spread = count - base * len(strata)
+    rest = sum(len(members) - base for members in strata.values())
+
+    # Largest remainder allocation of what is left after the guaranteed file per group
+    quotas = {key: spread * (len(members) - base) / rest if rest else 0.0 for key, members in strata.items()}
+    shares = {key: base + int(quota) for key, quota in quotas.items()}
+    leftover = count - sum(shares.values())
+    for key in sorted(strata, key=lambda k: (int(quotas[k]) - quotas[k], k))[:leftover]:
+        shares[key] += 1
+
+    sample = []
+    for key, members in strata.items():
+        members.sort()
+        sample.extend(file for _, file in members[:shares[key]])
+    return sorted(sample)
+
+
+class SampleRun:
+    """
+    Processes a sample of the input with the real pipeline and reports what a config does:
+    time per stage, output size against input size per extension, failures.
+    Outputs go to the configured output dir. With overwrite_files off, sampled files whose target
+    exists are skipped like in a real run, point output_dir_path to a scratch dir to time all of them
+    """
+
+    def __init__(self, file_manager: FileManager, sample_spec: str, seed: int = 0,
+                 stratify: Iterable[str] = ()) -> None:
+        self.file_manager = file_manager
+        self.sample_spec = sample_spec
+        self.seed = seed
+        self.stratify = tuple(stratify)
+
+    def run(self) -> dict:
+        fm = self.file_manager
+        if is_archive(fm.input_dir) or is_archive(fm.output_dir):
+            raise ValueError('Samples need input and output directories, archives are not supported')
+        if fm.clean_output_dir_flag:
+            logger.warning('clean_output_dir is ignored when processing a sample')
+
+        files = fm.get_input_files()
+        count = parse_sample_spec(self.sample_spec, len(files)) if files else 0
+        sample = pick_sample(files, fm.input_dir, count, self.seed, self.stratify)
+        logger.info(f'Sampled {len(sample)} of {len(files)} files (seed {self.seed}'
+                    + (f", stratified by {', '.join(self.stratify)})" if self.stratify else ')'))
+
+        results = fm.run_files(sample)
+        if fm.files_skipped:
+            logger.warning(f'{fm.files_skipped} sampled files already have outputs and overwrite_files is off, '
+                           f'they are not timed')
+
+        stages: dict[str, list] = {}  # stage -> [seconds, files]
+        sizes: dict[str, list[int]] = {}  # input ext -> [files, input bytes, output bytes]
+        for result in results:
+            for stage, seconds in (result.stage_seconds or {}).items():
+                timing = stages.setdefault(stage, [0.0, 0])
+                timing[0] += seconds
+                timing[1] += 1
+            if result.success:
+                self._count_sizes(result, sizes)
+
+        summary = fm.get_summary()
+        return {
+            'files': len(files),
+            'sampled': len(sample),
+            'processed': summary['files_processed'],
+            'copied': summary['files_copied'],
+            'skipped': summary['files_skipped'],
+            'failed': summary['files_failed'],
+            'stages': {stage: {'seconds': seconds, 'count': stage_count}
+                       for stage, (seconds, stage_count) in stages.items()},
+            'sizes': {ext: {'files': n, 'input_bytes': i, 'output_bytes': o, 'ratio': o / i if i else 0.0}
+                      for ext, (n, i, o) in sorted(sizes.items())},
+            'failures': summary['failures'],
+            'elapsed_seconds': summary['elapsed_seconds'],
+        }
+
+    @staticmethod
+    def _count_sizes(result: JobResult, sizes: dict) -> None:
+        if not result.outputs:
+            return
+        entry = sizes.setdefault(result.input_path.suffix[1:].lower() or '(none)', [0, 0, 0])
+        entry[0] += 1
+        entry[1] += result.input_path.stat().st_size
+        entry[2] += sum(output.stat().st_size for output in result.outputs)
+
+
+def log_sample_report(report: dict) -> None:
+    mb = 1024 * 1024
+    logger.info(f"Sample: {report['sampled']} of {report['files']} files, {report['processed']} processed, "
+                f"{report['copied']} copied, {report['skipped']} skipped, {report['failed']} failed "
+                f"in {report['elapsed_seconds']:.1f}s")
+    for stage, timing in report['stages'].items():
+        average = timing['seconds'] / timing['count'] if timing['count'] else 0.0
+        logger.info(f"Stage {stage}: {timing['seconds']:.2f}s total, {average * 1000:.1f} ms/file")
+    for ext, size in report['sizes'].items():
+        logger.info(f"{ext}: {size['files']} files, {size['input_bytes'] / mb:.1f} MB -> "
+                    f"{size['output_bytes'] / mb:.1f} MB (x{size['ratio']:.3f})")
+    for failure in report['failures']:
+        logger.error(f"Failed: {failure['file']}: {failure['error']}")
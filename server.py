@@ -0,0 +1,293 @@
+"""
+Local HTTP server around ImageHandler, a long-lived alternative to starting the CLI per request.
+
+POST /process?output_ext=<ext>  body: encoded image, header X-Operations: JSON of image operations
+GET  /health                    server counters as JSON
+
+CPU work runs in a warm process pool. Identical in-flight requests are computed once,
+recent results are kept in a small LRU cache.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image
+
+from logging_tools import get_logger
+from yaml_tools import ConfigError
+from api import prepare_image_operations
+from image_handler import ImageHandler
+from image_handler.saver import get_image_format
+
+
+logger = get_logger()
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+    413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+def _warm_worker() -> None:
+    """Runs once in every pool process: loads Pillow plugins before the first request needs them"""
+    Image.init()
+
+def _process(data: bytes, operations: dict, output_ext: str) -> bytes:
+    return ImageHandler().run_bytes(data, operations, output_ext)
+
+
+class HttpError(Exception):
+    """close: the request wasn't fully read, so the connection can't be reused"""
+    def __init__(self, status: int, message: str, close: bool = False) -> None:
+        super().__init__(message)
+        self.status = status
+        self.close = close
+
+
+class ResponseCache:
+    """LRU cache of encoded results, bounded by the total size of the values"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self._items:
+            self.size -= len(self._items.pop(key))
+        self._items[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class ImageServer:
+    def __init__(self, workers: int, max_pending: int, cache_bytes: int, max_body_bytes: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_body_bytes = max_body_bytes
+
+        self.pool: Optional[ProcessPoolExecutor] = None
+        # Keeps the pool busy but not flooded, everything above it waits in the event loop
+        self._slots = asyncio.Semaphore(workers * 2)
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._cache = ResponseCache(cache_bytes)
+        self._operations_cache: dict[tuple[str, str], dict] = {}
+
+        self.counters = {'requests': 0, 'computed': 0, 'coalesced': 0, 'cache_hits': 0, 'rejected': 0,
+                         'errors': 0, 'pool_restarts': 0}
+
+    async def serve(self, host: str, port: int) -> None:
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        # Start all worker processes now rather than on the first requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _warm_worker) for _ in range(self.workers)))
+
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f'Serving on http://{host}:{port} with {self.workers} workers')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def process(self, data: bytes, operations_json: str, output_ext: str) -> bytes:
+        operations = self._prepare_operations(operations_json, output_ext)
+        key = self._get_key(data, operations, output_ext)
+
+        result = self._cache.get(key)
+        if result is not None:
+            self.counters['cache_hits'] += 1
+            return result
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        if len(self._inflight) >= self.max_pending:
+            self.counters['rejected'] += 1
+            raise HttpError(503, 'Too many requests in progress, retry later')
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            async with self._slots:
+                self.counters['computed'] += 1
+                pool = self.pool
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        pool, _process, data, operations, output_ext)
+                except BrokenProcessPool:
+                    self.counters['errors'] += 1
+                    self._restart_pool(pool)
+                    raise HttpError(500, 'A worker process died while processing the request')
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters get the exception, this marks it as retrieved when there are none
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self._cache.put(key, result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def _restart_pool(self, broken: ProcessPoolExecutor) -> None:
+        """
+        A worker killed from outside (e.g. by the OOM killer) breaks the whole pool, every later submit
+        would fail. Requests that were running on it all see the error, the first one replaces the pool
+        """
+        if self.pool is not broken:
+            return
+        logger.error('A worker process died, restarting the process pool')
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        self.counters['pool_restarts'] += 1
+
+    def stats(self) -> dict:
+        return {**self.counters, 'inflight': len(self._inflight), 'cached': len(self._cache),
+                'cache_bytes': self._cache.size}
+
+    def _prepare_operations(self, operations_json: str, output_ext: str) -> dict:
+        cache_key = (operations_json, output_ext)
+        operations = self._operations_cache.get(cache_key)
+        if operations is None:
+            try:
+                operations = json.loads(operations_json)
+            except json.JSONDecodeError as e:
+                raise HttpError(400, f'X-Operations is not valid JSON: {e}')
+            if not isinstance(operations, dict):
+                raise HttpError(400, 'X-Operations must be a JSON object')
+            try:
+                operations = prepare_image_operations(operations, output_ext)
+            except ConfigError as e:
+                raise HttpError(400, str(e))
+            if len(self._operations_cache) >= 1024:
+                self._operations_cache.clear()
+            self._operations_cache[cache_key] = operations
+        return operations
+
+    @staticmethod
+    def _get_key(data: bytes, operations: dict, output_ext: str) -> str:
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps([operations, output_ext], sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line: bytes, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> bool:
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self._respond(writer, 400, b'Malformed request line', keep_alive=False)
+            return False
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        url = urlsplit(target)
+        self.counters['requests'] += 1
+
+        try:
+            match (method, url.path):
+                case ('GET', '/health'):
+                    body = json.dumps(self.stats()).encode('utf-8')
+                    await self._respond(writer, 200, body, 'application/json', keep_alive)
+                case ('POST', '/process'):
+                    data = await self._read_body(reader, headers)
+                    output_ext = parse_qs(url.query).get('output_ext', ['native'])[0].lower()
+                    result = await self.process(data, headers.get('x-operations', '{}'), output_ext)
+                    await self._respond(writer, 200, result, self._get_content_type(result, output_ext), keep_alive)
+                case (_, '/health' | '/process'):
+                    raise HttpError(405, f'{method} is not allowed for {url.path}')
+                case _:
+                    raise HttpError(404, f'Unknown path {url.path}')
+        except HttpError as e:
+            keep_alive = keep_alive and not e.close
+            await self._respond(writer, e.status, str(e).encode('utf-8'), keep_alive=keep_alive)
+        except Exception as e:
+            self.counters['errors'] += 1
+            logger.error(f'Failed to process request {method} {target}: {e}')
+            await self._respond(writer, 422, f'{type(e).__name__}: {e}'.encode('utf-8'), keep_alive=keep_alive)
+
+        return keep_alive
+
+    async def _read_body(self, reader: asyncio.StreamReader, headers: dict) -> bytes:
+        # The body of a rejected request is left unread, so the connection is closed after the response
+        if 'content-length' not in headers:
+            raise HttpError(411, 'Content-Length is required', close=True)
+        if not (headers['content-length'].isascii() and headers['content-length'].isdigit()):
+            raise HttpError(400, 'Content-Length must be a non-negative integer', close=True)
+        length = int(headers['content-length'])
+        if length > self.max_body_bytes:
+            raise HttpError(413, f'Body is larger than {self.max_body_bytes} bytes', close=True)
+        return await reader.readexactly(length)
+
+    @staticmethod
+    def _get_content_type(result: bytes, output_ext: str) -> str:
+        if output_ext == 'native':
+            with Image.open(io.BytesIO(result)) as image:
+                image_format = image.format
+        else:
+            image_format = get_image_format(output_ext)
+        return Image.MIME.get(image_format, 'application/octet-stream')
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, body: bytes,
+                       content_type: str = 'text/plain; charset=utf-8', keep_alive: bool = True) -> None:
+        head = (f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n')
+        if status == 503:
+            head += 'Retry-After: 1\r\n'
+        writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await writer.drain()
+
+
+def run_server(host: str, port: int, workers: Optional[int] = None, max_pending: int = 64,
+               cache_bytes: int = 64 * 1024 * 1024, max_body_bytes: int = 64 * 1024 * 1024) -> None:
+    server = ImageServer(workers or os.cpu_count() or 1, max_pending, cache_bytes, max_body_bytes)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        logger.info('Server stopped')
@@ -0,0 +1,72 @@
+"""
+Encoder settings of the config and what they cost.
+Run the module from the repository root to benchmark encode time against output size: python -m tests.test_encoders
+"""
+import io
+import time
+
+import pytest
+from PIL import Image, features
+
+from image_handler.saver import ImageSaver, get_save_params
+from tests.test_resize_backends import make_photo
+
+
+def available(image_format: str) -> bool:
+    try:
+        return features.check_module(image_format.lower())
+    except ValueError:
+        return False  # Pillow is too old to know the module
+
+def requires(image_format: str):
+    return pytest.mark.skipif(not available(image_format), reason=f'Pillow is built without {image_format}')
+
+
+def test_params_of_other_formats_are_left_out():
+    encoder = {'quality': 70, 'lossless': True, 'method': 6, 'speed': 8}
+    assert get_save_params('JPEG', encoder) == {'quality': 70}
+    assert get_save_params('WEBP', encoder) == {'quality': 70, 'lossless': True, 'method': 6}
+    assert get_save_params('PNG', encoder) == {}
+
+@pytest.mark.parametrize('image_format', ['JPEG', pytest.param('WEBP', marks=requires('WEBP')),
+                                          pytest.param('AVIF', marks=requires('AVIF'))])
+def test_lower_quality_gives_smaller_output(image_format):
+    image = make_photo((320, 240))
+    saver = ImageSaver()
+    assert len(saver.save_bytes(image, image_format, {'quality': 40})) < \
+        len(saver.save_bytes(image, image_format, {'quality': 95}))
+
+@requires('WEBP')
+def test_lossless_webp_keeps_pixels():
+    image = make_photo((320, 240))
+    encoded = ImageSaver().save_bytes(image, 'WEBP', {'lossless': True})
+    with Image.open(io.BytesIO(encoded)) as decoded:
+        assert decoded.convert('RGB').tobytes() == image.tobytes()
+
+
+def benchmark(repeat: int = 3) -> None:
+    cases = [('JPEG', {'quality': q}) for q in (50, 75, 85, 95)]
+    if available('WEBP'):
+        cases += [('WEBP', {'quality': 80, 'method': m}) for m in range(7)]
+        cases += [('WEBP', {'quality': q, 'method': 4}) for q in (50, 75, 95)]
+        cases += [('WEBP', {'lossless': True, 'method': m}) for m in (0, 4, 6)]
+    if available('AVIF'):
+        cases += [('AVIF', {'quality': 75, 'speed': s}) for s in (4, 6, 8, 10)]
+        cases += [('AVIF', {'quality': q, 'speed': 6}) for q in (50, 75, 95)]
+        cases += [('AVIF', {'lossless': True, 'speed': 6})]
+
+    image = make_photo((1200, 900))
+    saver = ImageSaver()
+    print(f'RGB {image.width}x{image.height}, {len(image.tobytes())} bytes decoded')
+    for image_format, encoder in cases:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            encoded = saver.save_bytes(image, image_format, encoder)
+            timings.append(time.perf_counter() - started)
+        settings = ', '.join(f'{key} {value}' for key, value in encoder.items())
+        print(f'  {image_format:5} {settings:24} {min(timings) * 1000:8.1f} ms  {len(encoded):9} bytes')
+
+
+if __name__ == '__main__':
+    benchmark()
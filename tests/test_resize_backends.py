@@ -0,0 +1,110 @@
+"""
+Quality of the numpy and OpenCV resize backends against Pillow, the reference output.
+Run the module from the repository root to benchmark the backends: python -m tests.test_resize_backends
+"""
+import time
+
+import pytest
+from PIL import Image
+
+from image_handler.resize_backends import PillowBackend, NumpyBackend, OpenCVBackend, get_resize_backend
+
+np = pytest.importorskip('numpy')
+
+
+def make_photo(size: tuple[int, int], mode: str = 'RGB') -> Image.Image:
+    """Smooth gradients with some noise, closer to a photo than flat colors"""
+    width, height = size
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    noise = np.random.default_rng(0).normal(0, 12, (height, width, 3))
+    bands = np.stack([255 * x * np.ones_like(y), 255 * y * np.ones_like(x), 128 + 127 * np.sin(8 * x + 5 * y)], axis=2)
+    image = Image.fromarray(np.clip(bands + noise, 0, 255).astype(np.uint8), 'RGB')
+    return image.convert(mode)
+
+def make_cutout(size: tuple[int, int]) -> Image.Image:
+    """An opaque blue shape on transparent red: colors of transparent pixels must not show at the edge"""
+    image = Image.new('RGBA', size, (255, 0, 0, 0))
+    image.paste((0, 0, 255, 255), (0, 0, size[0] * 5 // 7, size[1]))
+    return image
+
+def premultiplied(image: Image.Image):
+    array = np.asarray(image, dtype=np.float64)
+    if image.mode == 'RGBA':
+        array = np.concatenate((array[:, :, :3] * array[:, :, 3:] / 255, array[:, :, 3:]), axis=2)
+    return array
+
+def psnr(image: Image.Image, reference: Image.Image) -> float:
+    """Compares premultiplied values, the color of a transparent pixel is irrelevant"""
+    mse = np.mean((premultiplied(image) - premultiplied(reference)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+def test_numpy_box_matches_pillow(mode):
+    image = make_photo((640, 480), mode)
+    reference = PillowBackend().resize(image, (160, 120), Image.Resampling.BOX)
+    assert psnr(NumpyBackend().resize(image, (160, 120), Image.Resampling.BOX), reference) > 50
+
+def test_numpy_falls_back_to_pillow_for_uneven_factors():
+    image = make_photo((640, 480))
+    reference = PillowBackend().resize(image, (300, 200), Image.Resampling.LANCZOS)
+    assert psnr(NumpyBackend().resize(image, (300, 200), Image.Resampling.LANCZOS), reference) == float('inf')
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA'])
+def test_opencv_downscale_close_to_pillow(mode):
+    pytest.importorskip('cv2')
+    image = make_photo((1200, 900), mode)
+    reference = PillowBackend().resize(image, (300, 225), Image.Resampling.LANCZOS)
+    assert psnr(OpenCVBackend().resize(image, (300, 225), Image.Resampling.LANCZOS), reference) > 30
+
+@pytest.mark.parametrize('backend, resample', [
+    ('numpy', Image.Resampling.BOX),
+    ('opencv', Image.Resampling.LANCZOS),
+    ('auto', Image.Resampling.LANCZOS),
+])
+def test_rgba_edges_have_no_fringes(backend, resample):
+    if backend != 'numpy':
+        pytest.importorskip('cv2')
+    image = make_cutout((420, 420))
+    resized = get_resize_backend(backend, image.size, (60, 60), resample, image.mode).resize(image, (60, 60), resample)
+
+    array = np.asarray(resized)
+    visible = array[:, :, 3] > 0
+    assert not array[:, :, 0][visible].any(), 'transparent red bled into the edge'
+    assert psnr(resized, PillowBackend().resize(image, (60, 60), resample)) > 30
+
+def test_auto_keeps_pillow_for_upscales_and_small_downscales():
+    lanczos = Image.Resampling.LANCZOS
+    assert isinstance(get_resize_backend('auto', (100, 100), (200, 200), lanczos), PillowBackend)
+    assert isinstance(get_resize_backend('auto', (300, 300), (200, 200), lanczos), PillowBackend)
+    assert isinstance(get_resize_backend('auto', (800, 800), (200, 200), Image.Resampling.BOX), PillowBackend)
+    assert isinstance(get_resize_backend('auto', (800, 800), (200, 200), lanczos, 'RGBA'), PillowBackend)
+
+
+def benchmark(repeat: int = 5) -> None:
+    cases = [
+        ('RGB 4000x3000 -> 500x375 lanczos', make_photo((4000, 3000)), (500, 375), Image.Resampling.LANCZOS),
+        ('RGBA 4000x3000 -> 500x375 lanczos', make_photo((4000, 3000), 'RGBA'), (500, 375), Image.Resampling.LANCZOS),
+        ('RGB 4000x3000 -> 1000x750 box', make_photo((4000, 3000)), (1000, 750), Image.Resampling.BOX),
+        ('RGBA 4000x3000 -> 1000x750 box', make_photo((4000, 3000), 'RGBA'), (1000, 750), Image.Resampling.BOX),
+    ]
+    for title, image, size, resample in cases:
+        reference = PillowBackend().resize(image, size, resample)
+        print(title)
+        for name in ('pillow', 'numpy', 'opencv', 'auto'):
+            try:
+                backend = get_resize_backend(name, image.size, size, resample, image.mode)
+            except ValueError as e:
+                print(f'  {name:8} skipped: {e}')
+                continue
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                resized = backend.resize(image, size, resample)
+                timings.append(time.perf_counter() - started)
+            print(f'  {name:8} {min(timings) * 1000:7.1f} ms  PSNR {psnr(resized, reference):6.1f} dB')
+
+
+if __name__ == '__main__':
+    benchmark()
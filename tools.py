@@ -1,4 +1,6 @@
-from pathlib import Path
+from pathlib import Path, PurePath
+import hashlib
+import os
 import shutil
 from constants import CONST
 
@@ -42,10 +44,46 @@ def clean_dir(dir_path: Path) -> None:
             shutil.rmtree(item)  # Remove subdirectories and their contents
 
 
+def scan_dir(dir_path: Path, recursive: bool = True) -> tuple[list[Path], set[Path]]:
+    """
+    Lists files and subdirectories of the directory with one readdir per directory.
+    File types come from the directory entries, so no file is stat-ed (except symlinks).
+    A missing directory is treated as empty
+    """
+    files = []
+    dirs = set()
+    pending = [dir_path]
+
+    while pending:
+        current = pending.pop()
+        try:
+            entries = list(os.scandir(current))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.add(Path(entry.path))
+                if recursive:
+                    pending.append(Path(entry.path))
+            elif entry.is_file():
+                files.append(Path(entry.path))
+
+    return files, dirs
+
+
 def copy_file(input_path: Path, target_path: Path) -> None:
     shutil.copy(input_path, target_path)
 
 
+def shard_of(relative_path: PurePath, shard_count: int) -> int:
+    """
+    Returns the shard index of a file by a stable hash of its relative path.
+    Doesn't depend on PYTHONHASHSEED, platform or file order, so every node computes the same assignment
+    """
+    digest = hashlib.blake2b(relative_path.as_posix().encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
 def split_config(full_config):
     """
     Splits config in: